@@ -0,0 +1,309 @@
+"""
+Time the detection hot paths offline, without a camera or a window.
+
+Every case is fed from a synthetic landmark stream, or from the landmarks cached by gesture_recorder.py
+with --recorded, and reports per-call latency percentiles and the memory allocated per call.
+Results are saved as JSON so that a later run can be compared against them.
+
+Run from the repository root with:
+python -m benchmarks.hot_paths
+python -m benchmarks.hot_paths --compare benchmarks/results/<earlier run>.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from gesture_tracker import GestureTracker
+from pose_recorder import NUM_LANDMARKS, PoseRecorder
+from utils.config import FOCUS_LANDMARK_IDS
+from utils.landmark_cache import CACHE_DIR
+from utils.landmarks import NUM_POSE_LANDMARKS, empty_landmarks, write_landmarks
+from utils.ring_buffer import PointRingBuffer
+from utils.tracker_2d import preprocess_landmarks, process_landmarks, simplify_gesture, smooth_landmarks
+
+RESULTS_DIR = 'benchmarks/results'
+POSE_LIBRARY_SIZES = (10, 100, 1_000)
+GESTURE_LIBRARY_SIZES = (1, 10, 100)
+BUFFER_SIZES = (15, 25, 40)
+CALLS = 200
+WARMUP_CALLS = 10
+ALLOCATION_CALLS = 20
+REGRESSION_TOLERANCE = 0.1
+
+
+def measure(call, calls: int = CALLS) -> dict:
+    """
+    Time a benchmark case, then measure its allocations in a separate pass since tracing slows every call.
+
+    :param call: function running one call of the case, returning False if the call should not be counted
+    :param calls: number of calls to time
+    :return: latency percentiles in microseconds and allocations in KiB per call
+    """
+    for _ in range(WARMUP_CALLS):
+        call()
+
+    latencies = []
+    while len(latencies) < calls:
+        start = time.perf_counter_ns()
+        counted = call()
+        elapsed = time.perf_counter_ns() - start
+        if counted is not False:
+            latencies.append(elapsed / 1000)
+
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    while len(peaks) < min(calls, ALLOCATION_CALLS):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        counted = call()
+        current, peak = tracemalloc.get_traced_memory()
+        if counted is not False:
+            peaks.append((peak - before) / 1024)
+            retained.append((current - before) / 1024)
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+    return {
+        'calls': calls,
+        'mean_us': float(np.mean(latencies)),
+        'p50_us': float(p50),
+        'p95_us': float(p95),
+        'p99_us': float(p99),
+        'peak_kib': float(np.mean(peaks)),
+        'retained_kib': float(np.mean(retained))
+    }
+
+
+def synthetic_stream(frames: int, landmarks: int, rng: np.random.Generator):
+    """
+    Random walks shaped like the focus points of set_focus_points, with some occluded frames.
+
+    :return: tuple of (points of shape (frames, landmarks, 2), visibility of shape (frames, landmarks))
+    """
+    points = np.cumsum(rng.normal(0, 0.02, (frames, landmarks, 2)), axis=0) + rng.normal(0, 0.3, (1, landmarks, 2))
+    visible = rng.random((frames, landmarks)) > 0.05
+    points[~visible] = 0
+    return points.astype(np.float32), visible
+
+
+def recorded_stream(cache_dir: str):
+    """Focus points of every video in the landmark cache, joined into one stream, None if the cache is empty"""
+    files = sorted(file for file in os.listdir(cache_dir) if file.endswith('.npy')) if os.path.isdir(cache_dir) else []
+    if not files:
+        return None
+
+    landmarks = np.concatenate([np.load(os.path.join(cache_dir, file)) for file in files])
+    landmarks = landmarks[:, FOCUS_LANDMARK_IDS]
+
+    # Same rule as GestureTracker.set_focus_points, with frames without a pose treated as not visible
+    visible = np.nan_to_num(landmarks[..., 3]) >= 0.7
+    points = np.where(visible[..., np.newaxis], np.nan_to_num(landmarks[..., :2]), 0)
+    return points.astype(np.float32), visible
+
+
+def synthetic_landmark_list(count: int, rng: np.random.Generator):
+    """Landmark list like the ones in mediapipe results, with random x, y, z and visibility"""
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, visibility in rng.random((count, 4)):
+        landmark_list.landmark.add(x=x, y=y, z=z, visibility=visibility)
+
+    return landmark_list
+
+
+def synthetic_hands(count: int, rng: np.random.Generator) -> np.ndarray:
+    """Hand landmarks like the ones write_landmarks passes to calculate_ratios"""
+    hands = rng.random((count, NUM_LANDMARKS, 4)).astype(np.float32)
+    hands[..., 3] = 0
+    return hands
+
+
+def landmark_cases(rng: np.random.Generator, calls: int) -> dict:
+    """Copy mediapipe results into the landmark arrays every consumer reads from"""
+    frame_results = {
+        'pose': SimpleNamespace(pose_landmarks=synthetic_landmark_list(NUM_POSE_LANDMARKS, rng),
+                                pose_world_landmarks=synthetic_landmark_list(NUM_POSE_LANDMARKS, rng)),
+        'hands': SimpleNamespace(multi_hand_landmarks=[synthetic_landmark_list(NUM_LANDMARKS, rng) for _ in range(2)])
+    }
+
+    results = {}
+    for kind, kind_results in frame_results.items():
+        output = empty_landmarks(kind)
+        results[f'landmarks/write_landmarks/{kind}'] = measure(
+            lambda: write_landmarks(kind, kind_results, output), calls)
+
+    return results
+
+
+def pose_cases(rng: np.random.Generator, calls: int) -> dict:
+    hands = synthetic_hands(calls, rng)
+    results = {}
+    with tempfile.TemporaryDirectory() as empty_dir:
+        recorder = PoseRecorder(camera=None, save_dir=empty_dir, library_dir=empty_dir)
+
+        for size in POSE_LIBRARY_SIZES:
+            # Saved poses are ratios of other hands, so some of the queries match
+            hands_saved = synthetic_hands(size, rng)
+            poses = {str(index): recorder.calculate_ratios(hand) for index, hand in enumerate(hands_saved)}
+            recorder.poses = poses
+            recorder.pose_names = list(poses.keys())
+            recorder.pose_matrix = recorder.build_pose_matrix(poses)
+
+            queue = itertools.cycle(hands)
+            results[f'pose/calculate_ratios+check_pose/poses={size}'] = measure(
+                lambda: recorder.check_pose(recorder.calculate_ratios(next(queue))), calls)
+
+    return results
+
+
+def trajectory_cases(points: np.ndarray, calls: int) -> dict:
+    results = {}
+    for buffer_size in BUFFER_SIZES:
+        windows = [points[start:start + buffer_size].transpose(1, 0, 2) for start in range(len(points) - buffer_size)]
+
+        histories = [{landmark_id: [tuple(point) for point in trajectory]
+                      for landmark_id, trajectory in zip(FOCUS_LANDMARK_IDS, window)} for window in windows[:calls]]
+        queue = iter(histories * 2)
+        results[f'tracker_2d/process_landmarks/buffer={buffer_size}'] = measure(
+            lambda: process_landmarks(next(queue)), calls)
+
+        # simplify_gesture runs on the smoothed trajectory of a single landmark
+        trajectories = [trajectory for window in windows[:calls] for trajectory in smooth_landmarks(window)]
+        queue = iter(trajectories * 2)
+        results[f'tracker_2d/simplify_gesture/buffer={buffer_size}'] = measure(
+            lambda: simplify_gesture(next(queue), 0.01), calls)
+
+    return results
+
+
+def synthetic_gestures(count: int, landmark_ids: list[int], rng: np.random.Generator) -> list[dict]:
+    """Templates simplified the same way as the ones gesture_recorder.py builds"""
+    gestures = []
+    for index in range(count):
+        points, _ = synthetic_stream(30, len(landmark_ids), rng)
+        simplified = preprocess_landmarks(points.transpose(1, 0, 2), landmark_ids)
+        gestures.append(GestureTracker.prepare_templates({
+            'name': f'synthetic-{index}',
+            'points': {str(landmark_id): trajectory for landmark_id, trajectory in simplified.items()}
+        }))
+
+    return gestures
+
+
+def tracker_cases(points: np.ndarray, visible: np.ndarray, rng: np.random.Generator, calls: int) -> dict:
+    tracker = GestureTracker(camera=None)
+    landmark_ids = tracker.required_landmarks or FOCUS_LANDMARK_IDS[:2]
+
+    results = {}
+    for size in GESTURE_LIBRARY_SIZES:
+        tracker.gestures = synthetic_gestures(size, landmark_ids, rng)
+        tracker.required_landmarks = landmark_ids
+
+        # Each window length alone, then all of them from one shared history
+        for window_sizes in [(buffer_size,) for buffer_size in BUFFER_SIZES] + [BUFFER_SIZES]:
+            tracker.window_sizes = window_sizes
+            tracker.point_history = PointRingBuffer(max(window_sizes), FOCUS_LANDMARK_IDS)
+            frames = itertools.count()
+
+            def detect():
+                # Feed frames like GestureTracker.run, only counting the calls made on a full history
+                frame = next(frames) % len(points)
+                tracker.point_history.append(points[frame], visible[frame])
+                if len(tracker.point_history) < tracker.point_history.capacity:
+                    return False
+
+                tracker.detect_gesture()
+
+            name = '+'.join(map(str, window_sizes))
+            results[f'tracker/detect_gesture/gestures={size}/buffer={name}'] = measure(detect, calls)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> list[str]:
+    """
+    Print the change of every case against a baseline run.
+
+    :return: names of the cases whose median latency regressed by more than the tolerance
+    """
+    regressions = []
+    print(f'\n{"case":<58} {"base p50":>10} {"p50":>10} {"change":>8}')
+    for name, result in results['cases'].items():
+        if name not in baseline['cases']:
+            continue
+
+        before = baseline['cases'][name]['p50_us']
+        change = result['p50_us'] / before - 1
+        flag = ' !' if change > tolerance else ''
+        print(f'{name:<58} {before:>10.1f} {result["p50_us"]:>10.1f} {change:>+7.1%}{flag}')
+        if flag:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the detection hot paths offline.')
+    parser.add_argument('--calls', type=int, default=CALLS, help='timed calls per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--recorded', nargs='?', const=CACHE_DIR, default=None,
+                        help='feed the landmarks cached by gesture_recorder.py instead of a synthetic stream')
+    parser.add_argument('--output', help=f'results file, a timestamped file in {RESULTS_DIR} by default')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='relative p50 slowdown reported as a regression')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    stream = recorded_stream(args.recorded) if args.recorded else None
+    if args.recorded and stream is None:
+        sys.exit(f'No cached landmarks in {args.recorded}')
+    points, visible = stream if stream is not None else synthetic_stream(2_000, len(FOCUS_LANDMARK_IDS), rng)
+
+    cases = {}
+    cases.update(landmark_cases(rng, args.calls))
+    cases.update(pose_cases(rng, args.calls))
+    cases.update(trajectory_cases(points, args.calls))
+    cases.update(tracker_cases(points, visible, rng, args.calls))
+
+    print(f'{"case":<58} {"p50 us":>10} {"p95 us":>10} {"p99 us":>10} {"peak KiB":>9}')
+    for name, result in cases.items():
+        print(f'{name:<58} {result["p50_us"]:>10.1f} {result["p95_us"]:>10.1f} {result["p99_us"]:>10.1f} '
+              f'{result["peak_kib"]:>9.1f}')
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'stream': args.recorded or 'synthetic',
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'cases': cases
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f'hot_paths-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'\nSaved results to {output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(f'{len(regressions)} case(s) regressed by more than {args.tolerance:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the KD-tree pose index against the linear scan.
+The tree column always queries the tree, to choose the library size PoseIndex starts building it from.
+
+Run from the repository root with:
+python -m benchmarks.pose_index
+"""
+
+import time
+
+import numpy as np
+
+from utils.pose_index import PoseIndex, best_poses
+
+NUM_LANDMARKS = 21
+LIBRARY_SIZES = (100, 500, 800, 1_000, 10_000)
+QUERIES = 200
+POSE_LENIENCY = 0.3
+POSE_THRESHOLD = 0.99
+
+
+def synthetic_library(size: int, rng: np.random.Generator) -> np.ndarray:
+    """Build pose vectors shaped like calculate_ratios output: 0 at the wrist and normalized to a max of 1"""
+    poses = rng.random((size, NUM_LANDMARKS))
+    poses[:, 0] = 0
+    return poses / poses.max(axis=1, keepdims=True)
+
+
+def synthetic_queries(library: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Perturb random library poses, with every other query drawn at random so some miss"""
+    queries = library[rng.integers(len(library), size=QUERIES)] + rng.normal(0, 0.05, (QUERIES, NUM_LANDMARKS))
+    queries[1::2] = synthetic_library(QUERIES // 2, rng)
+    return queries
+
+
+def time_per_query(match, queries: np.ndarray):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(match(query[np.newaxis, :])[0])
+
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"poses":>8} {"linear ms":>10} {"tree ms":>10} {"index ms":>10} {"build ms":>10} {"speedup":>8}')
+
+    for size in LIBRARY_SIZES:
+        library = synthetic_library(size, rng)
+        queries = synthetic_queries(library, rng)
+
+        tree = PoseIndex(POSE_LENIENCY, POSE_THRESHOLD, min_poses=0)
+        start = time.perf_counter()
+        tree.update(library)
+        build_ms = (time.perf_counter() - start) * 1000
+        index = PoseIndex(POSE_LENIENCY, POSE_THRESHOLD)
+        index.update(library)
+
+        linear_ms, linear = time_per_query(
+            lambda ratios: best_poses(ratios, library, POSE_LENIENCY, POSE_THRESHOLD), queries)
+        tree_ms, from_tree = time_per_query(lambda ratios: tree.query(ratios, library), queries)
+        index_ms, indexed = time_per_query(lambda ratios: index.query(ratios, library), queries)
+
+        assert linear == from_tree == indexed, 'index and linear scan disagree'
+        print(f'{size:>8} {linear_ms:>10.3f} {tree_ms:>10.3f} {index_ms:>10.3f} {build_ms:>10.3f} '
+              f'{linear_ms / index_ms:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Time the cold start of the tracker entry points, up to their first processed frame.
+
+Every run starts a fresh interpreter, so nothing is imported or cached yet, and reports how long each phase took:
+starting the interpreter, importing the entry point, creating the tracker with its capture, creating the
+MediaPipe model and reading and processing the first frame. Frames come from a video file, so no camera is needed.
+Results are saved as JSON so that a later run can be compared against them.
+
+Run from the repository root with:
+python -m benchmarks.startup --source <video>
+python -m benchmarks.startup --source <video> --compare benchmarks/results/<earlier run>.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+RESULTS_DIR = 'benchmarks/results'
+ENTRY_POINTS = ('gesture_tracker', 'pose_recorder')
+PHASES = ('interpreter', 'import', 'init', 'model', 'first_frame')
+RUNS = 5
+# Time to the first processed frame has to drop by at least this fraction against the compared run. Deferring
+# every import not needed for the first frame took it 27% below the eager imports (1074 to 783 ms for gesture_tracker,
+# 954 to 685 ms for pose_recorder, 720p video, model_complexity=1, one CPU). Importing mediapipe, which imports
+# matplotlib itself, is about 430 ms of what is left and cannot be avoided before the first inference
+TARGET_REDUCTION = 0.25
+READ_TIMEOUT = 10.0
+
+
+def start_gesture_tracker(source, model_complexity: int = None) -> dict:
+    """Start the gesture tracker the way gesture_tracker.py does and process one frame"""
+    laps = {}
+    start = time.perf_counter()
+
+    from gesture_tracker import POSE_SETTINGS, GestureTracker
+    from utils import config
+    laps['import'] = time.perf_counter()
+
+    tracker = GestureTracker(camera=source)
+    laps['init'] = time.perf_counter()
+
+    settings = POSE_SETTINGS if model_complexity is None else {**POSE_SETTINGS, 'model_complexity': model_complexity}
+    with config.mp_pose.Pose(**settings) as pose:
+        laps['model'] = time.perf_counter()
+
+        ret, frame = tracker.capture.read(timeout=READ_TIMEOUT)
+        if not ret:
+            raise RuntimeError(f'Could not read a frame from {source}')
+        tracker.process_frame(frame, pose, display=False)
+        laps['first_frame'] = time.perf_counter()
+
+    tracker.capture.release()
+    return durations(start, laps)
+
+
+def start_pose_recorder(source, model_complexity: int = None) -> dict:
+    """Start the pose recorder the way pose_recorder.py does and match the hands of one frame"""
+    laps = {}
+    start = time.perf_counter()
+
+    import cv2
+
+    from pose_recorder import PoseRecorder
+    from utils import config
+    from utils.landmarks import found_rows, write_landmarks
+    laps['import'] = time.perf_counter()
+
+    recorder = PoseRecorder(camera=source) if model_complexity is None else \
+        PoseRecorder(camera=source, model_complexity=model_complexity)
+    laps['init'] = time.perf_counter()
+
+    with config.mp_hands.Hands(**recorder.model_settings) as hands:
+        laps['model'] = time.perf_counter()
+
+        ret, frame = recorder.capture.read(timeout=READ_TIMEOUT)
+        if not ret:
+            raise RuntimeError(f'Could not read a frame from {source}')
+        results = hands.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        write_landmarks('hands', results, recorder.landmarks)
+        hands_found = found_rows(recorder.landmarks)
+        if len(hands_found):
+            recorder.match_hands(hands_found)
+        laps['first_frame'] = time.perf_counter()
+
+    recorder.capture.release()
+    recorder.capture = None
+    return durations(start, laps)
+
+
+def durations(start: float, laps: dict) -> dict:
+    """Milliseconds spent in each phase, given the time each one ended"""
+    result = {}
+    for phase, end in laps.items():
+        result[phase] = (end - start) * 1000
+        start = end
+
+    return result
+
+
+def run_child(entry_point: str, source, spawned: float, model_complexity: int = None):
+    """Measure one cold start in this fresh interpreter and print its phases as JSON"""
+    interpreter = (time.time() - spawned) * 1000
+    start = start_gesture_tracker if entry_point == 'gesture_tracker' else start_pose_recorder
+    phases = {'interpreter': interpreter, **start(source, model_complexity)}
+    print(json.dumps(phases))
+
+
+def cold_start(entry_point: str, source, model_complexity: int = None) -> dict:
+    """Run one cold start of the entry point in a new interpreter and return its phases in milliseconds"""
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child', entry_point, '--source', str(source),
+               '--spawned', repr(time.time())]
+    if model_complexity is not None:
+        command += ['--model-complexity', str(model_complexity)]
+
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode:
+        raise RuntimeError(f'{entry_point} failed to start:\n{completed.stderr}')
+
+    # MediaPipe logs to stderr, the phases are the last line of stdout
+    phases = json.loads(completed.stdout.strip().splitlines()[-1])
+    phases['total'] = sum(phases[phase] for phase in PHASES)
+    return phases
+
+
+def measure(entry_point: str, source, runs: int, model_complexity: int = None) -> dict:
+    """Median duration of every phase over several cold starts"""
+    samples = [cold_start(entry_point, source, model_complexity) for _ in range(runs)]
+    return {phase: statistics.median(sample[phase] for sample in samples) for phase in (*PHASES, 'total')}
+
+
+def compare(results: dict, baseline: dict, target: float = TARGET_REDUCTION) -> list[str]:
+    """
+    Print the change of every entry point against a baseline run.
+
+    :return: names of the entry points whose time to the first frame dropped by less than the target
+    """
+    missed = []
+    print(f'\n{"entry point":<18} {"phase":<12} {"base ms":>9} {"ms":>9} {"change":>8}')
+    for name, result in results['entry_points'].items():
+        if name not in baseline['entry_points']:
+            continue
+
+        for phase in (*PHASES, 'total'):
+            before = baseline['entry_points'][name][phase]
+            change = result[phase] / before - 1
+            flag = ' !' if phase == 'total' and change > -target else ''
+            print(f'{name:<18} {phase:<12} {before:>9.1f} {result[phase]:>9.1f} {change:>+7.1%}{flag}')
+            if flag:
+                missed.append(name)
+
+    return missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the tracker entry points.')
+    parser.add_argument('--source', required=True, help='video path, or camera ID, the first frame is read from')
+    parser.add_argument('--entry-points', nargs='+', default=ENTRY_POINTS, choices=ENTRY_POINTS)
+    parser.add_argument('--runs', type=int, default=RUNS, help='cold starts per entry point, the median is reported')
+    parser.add_argument('--model-complexity', type=int, choices=(0, 1, 2), default=None,
+                        help='model complexity instead of the one each entry point uses')
+    parser.add_argument('--output', help=f'results file, a timestamped file in {RESULTS_DIR} by default')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    parser.add_argument('--target', type=float, default=TARGET_REDUCTION,
+                        help='relative reduction of the time to the first frame expected against the compared run')
+    parser.add_argument('--child', choices=ENTRY_POINTS, help=argparse.SUPPRESS)
+    parser.add_argument('--spawned', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    if args.child:
+        run_child(args.child, source, args.spawned, args.model_complexity)
+        return
+
+    entry_points = {}
+    print(f'{"entry point":<18} ' + ' '.join(f'{phase:>12}' for phase in (*PHASES, 'total')))
+    for entry_point in args.entry_points:
+        entry_points[entry_point] = result = measure(entry_point, source, args.runs, args.model_complexity)
+        print(f'{entry_point:<18} ' + ' '.join(f'{result[phase]:>12.1f}' for phase in (*PHASES, 'total')))
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'source': str(args.source),
+        'runs': args.runs,
+        'model_complexity': args.model_complexity,
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'entry_points': entry_points
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f'startup-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'\nSaved results to {output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            missed = compare(results, json.load(f), args.target)
+        if missed:
+            sys.exit(f'{len(missed)} entry point(s) started less than {args.target:.0%} faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,59 +1,148 @@
+import argparse
 import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import cv2
 import numpy as np
-from fastdtw import fastdtw
-from matplotlib import pyplot as plt
-from scipy.spatial.distance import euclidean
 
-from utils.config import FOCUS_POINTS, mp_drawing, mp_pose, draw_style
+from gesture_tracker import COMPILED_THRESHOLDS_PATH, GestureTracker
+from utils import config
+from utils.config import FOCUS_LANDMARK_IDS
+from utils.landmark_cache import LandmarkCache
+from utils.landmarks import NUM_POSE_LANDMARKS, empty_landmarks, to_landmark_list, write_landmarks
+from utils.template_store import load_json
 from utils.tracker_2d import process_landmarks
+from utils.tracker_3d import process_landmarks_3d
 
+VIDEO_EXTENSIONS = ('.mov', '.mp4')
+# Optional file in the videos directory with the [first, last] frame of the gesture in each video,
+# keyed by the path of the video relative to that directory, e.g. {"punch/1.mp4": [42, 60]}
+ANNOTATIONS_FILE = 'annotations.json'
+POSE_SETTINGS = {
+    'static_image_mode': True,
+    'model_complexity': 1,
+    'min_detection_confidence': 0.5
+}
 
-def record(gesture_name, file_name):
+# Percentile of the compiled scores of a gesture on videos of anything else that becomes its threshold
+COMPILED_PERCENTILE = 1.0
+
+# MediaPipe instance of each batch worker process, created once by init_worker
+worker_pose = None
+# Gesture tracker of each evaluation worker process, created on its first video
+worker_tracker = None
+
+
+def create_pose():
+    return config.mp_pose.Pose(**POSE_SETTINGS)
+
+
+def record(gesture_name, file_name, display: bool = True, cache: bool = True):
     # Check if .mov or .mp4 file exists - if it does, choose the right one
     if not os.path.isfile(path := os.path.join("data", "videos", gesture_name, f"{file_name}.mov")):
         path = os.path.join("data", "videos", gesture_name, f"{file_name}.mp4")
 
-    cap = cv2.VideoCapture(path)
+    history = record_video(path, display=display, cache=LandmarkCache() if cache else None)
 
-    history = {num.value: [] for num in FOCUS_POINTS}
+    print('Frames:', len(history[list(history.keys())[0]]))
 
-    with mp_pose.Pose(
-            static_image_mode=True,
-            model_complexity=1,
-            min_detection_confidence=0.5
-    ) as pose:
-        while cap.isOpened():
-            ret, image = cap.read()
-            if not ret:
-                break
+    return history
 
-            image.flags.writeable = False
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            results = pose.process(image)
 
+def record_video(path: str, pose=None, display: bool = True, cache: LandmarkCache = None):
+    """
+    Track the focus points through every frame of a video.
+
+    :param path: path of the video
+    :param pose: mediapipe pose instance to run on each frame, created if needed when None
+    :param display: whether to show the annotated frames while recording
+    :param cache: cache to read the landmarks from and store them in
+    :return: list of (x, y) world coordinates for each focus point
+    """
+    return landmarks_to_history(load_landmarks(path, pose, display=display, cache=cache))
+
+
+def load_landmarks(path: str, pose=None, display: bool = True, cache: LandmarkCache = None) -> np.ndarray:
+    """
+    Extract the landmarks of every frame of a video.
+    When the landmarks of the video are cached, inference and display are skipped entirely.
+
+    :param path: path of the video
+    :param pose: mediapipe pose instance to run on each frame, created if needed when None
+    :param display: whether to show the annotated frames while recording
+    :param cache: cache to read the landmarks from and store them in
+    :return: numpy array of shape (frames, 33, 4), see extract_landmarks
+    """
+    landmarks = None
+    if cache is not None:
+        key = cache.key(path, **POSE_SETTINGS)
+        landmarks = cache.load(key)
+
+    if landmarks is None:
+        if pose is None:
+            with create_pose() as pose:
+                landmarks, finished = extract_landmarks(path, pose, display=display)
+        else:
+            landmarks, finished = extract_landmarks(path, pose, display=display)
+
+        if cache is not None and finished:
+            cache.save(key, landmarks)
+
+    return landmarks
+
+
+def extract_landmarks(path: str, pose, display: bool = True):
+    """
+    Run pose inference on every frame of a video.
+
+    :param path: path of the video
+    :param pose: mediapipe pose instance to run on each frame
+    :param display: whether to show the annotated frames while recording
+    :return: tuple of (float32 array of shape (frames, 33, 4) with the x, y, z and visibility of every
+             world landmark, NaN for frames without a pose, whether the whole video was processed)
+    """
+    cap = cv2.VideoCapture(path)
+
+    frames = []
+    landmarks = empty_landmarks('pose')
+    finished = True
+    while cap.isOpened():
+        ret, image = cap.read()
+        if not ret:
+            break
+
+        image.flags.writeable = False
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        write_landmarks('pose', pose.process(image), landmarks)
+        image_landmarks, world_landmarks = landmarks
+        frames.append(world_landmarks.copy())
+
+        if display:
             # Draw the pose annotation on the image.
             image.flags.writeable = True
             image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            mp_drawing.draw_landmarks(image, results.pose_landmarks,  # type: ignore
-                                      mp_pose.POSE_CONNECTIONS, landmark_drawing_spec=draw_style)
-
-            if results.pose_world_landmarks:  # type: ignore
-                for num in FOCUS_POINTS:
-                    landmark = results.pose_world_landmarks.landmark[num.value]  # type: ignore
-                    history[num.value].append((landmark.x, landmark.y) if landmark else (0, 0))
+            if not np.isnan(image_landmarks[0, 0]):
+                config.mp_drawing.draw_landmarks(image, to_landmark_list(image_landmarks),
+                                                 config.mp_pose.POSE_CONNECTIONS,
+                                                 landmark_drawing_spec=config.draw_style)
 
             cv2.imshow('MediaPipe Pose', cv2.flip(image, 1))
             if cv2.waitKey(5) & 0xFF == 27:
+                finished = False
                 break
 
-        cap.release()
+    cap.release()
 
-    print('Frames:', len(history[list(history.keys())[0]]))
+    return np.array(frames, dtype=np.float32).reshape(-1, NUM_POSE_LANDMARKS, 4), finished
 
-    return history
+
+def landmarks_to_history(landmarks: np.ndarray, dims: int = 2):
+    """Collect the (x, y) or (x, y, z) coordinates of each focus point over the frames in which a pose was found"""
+    landmarks = landmarks[~np.isnan(landmarks[:, 0, 0])]
+    return {landmark_id: list(map(tuple, landmarks[:, landmark_id, :dims].tolist()))
+            for landmark_id in FOCUS_LANDMARK_IDS}
 
 
 gesture = 'punch'
@@ -62,6 +151,9 @@ gesture = 'punch'
 def main():
     history = record(gesture, '4')
     processed = process_landmarks(history, plot=True)
+    if not processed:
+        print('No landmark moved enough, nothing saved')
+        return
 
     save_json(processed)
 
@@ -71,7 +163,108 @@ def save_json(processed):
         json.dump(processed, f, indent=4)
 
 
+def save_template(path: str, name: str, processed, duration: list[int] = None):
+    """
+    Write a gesture template.
+
+    :param path: path of the JSON file
+    :param name: name of the gesture
+    :param processed: simplified points for each landmark id
+    :param duration: (shortest, longest) number of frames the gesture takes, which sets the windows it is matched at
+    :return:
+    """
+    data = {'name': name, 'points': processed}
+    if duration:
+        data['duration'] = list(duration)
+
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4)
+
+
+def init_worker():
+    global worker_pose
+    worker_pose = create_pose()
+
+
+def build_video(gesture_name: str, path: str, cache: LandmarkCache = None, dims: int = 2):
+    """
+    Build the template of a single video in a batch worker.
+
+    :param gesture_name: name of the gesture performed in the video
+    :param path: path of the video
+    :param cache: cache of the landmarks extracted from videos
+    :param dims: 2 to build (x, y) templates, 3 to build (x, y, z) templates for the 'dtw3d' tracker mode
+    :return: tuple of (gesture name, path, processed landmarks or None if no pose was found, frames, seconds),
+        the processed landmarks are empty if no landmark moved enough to be selected
+    """
+    start = time.perf_counter()
+    history = landmarks_to_history(load_landmarks(path, worker_pose, display=False, cache=cache), dims=dims)
+    frames = len(history[list(history.keys())[0]])
+    processed = (process_landmarks_3d if dims == 3 else process_landmarks)(history) if frames else None
+
+    return gesture_name, path, processed, frames, time.perf_counter() - start
+
+
+def build_templates(videos_dir: str = 'data/videos', models_dir: str = 'data/models/gestures', workers: int = None,
+                    cache: bool = True, dims: int = 2):
+    """
+    Build a template from every video under videos_dir/<gesture>/ without any display,
+    spreading the videos across a pool of processes with one MediaPipe instance each.
+    A gesture with a single video is saved as <gesture>.json, otherwise as <gesture>_<video>.json.
+
+    :param videos_dir: directory with one sub-directory of videos per gesture
+    :param models_dir: directory to write the templates to
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param cache: whether to reuse the landmarks cached by earlier runs
+    :param dims: 2 to build (x, y) templates, 3 to build (x, y, z) templates saved with a _3d suffix
+    :return:
+    """
+    videos = list_videos(videos_dir)
+
+    os.makedirs(models_dir, exist_ok=True)
+    landmark_cache = LandmarkCache() if cache else None
+    start = time.perf_counter()
+    total_frames = 0
+    built = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = [executor.submit(build_video, gesture_name, path, landmark_cache, dims)
+                   for gesture_name, paths in videos.items() for path in paths]
+
+        for future in as_completed(futures):
+            gesture_name, path, processed, frames, seconds = future.result()
+            total_frames += frames
+            if processed is None:
+                print(f'{path}: no pose found in {seconds:.2f}s, skipped')
+                continue
+            if not processed:
+                # An empty template would match nothing and crash the tracker loading it
+                print(f'{path}: no landmark moved enough in {frames} frames, skipped')
+                continue
+
+            file_name = gesture_name
+            if len(videos[gesture_name]) > 1:
+                file_name += '_' + os.path.splitext(os.path.basename(path))[0]
+            if dims == 3:
+                file_name += '_3d'
+
+            # A duration declared in an earlier template survives the rebuild
+            template_path = os.path.join(models_dir, f'{file_name}.json')
+            previous = load_json(template_path) if os.path.isfile(template_path) else None
+            save_template(template_path, gesture_name, processed,
+                          duration=previous.get('duration') if isinstance(previous, dict) else None)
+            built += 1
+
+            print(f'{path}: {frames} frames in {seconds:.2f}s ({frames / (seconds or 1):.1f} fps) -> {file_name}.json')
+
+    seconds = time.perf_counter() - start
+    print(f'Built {built} of {len(futures)} templates from {total_frames} frames in {seconds:.2f}s '
+          f'({total_frames / (seconds or 1):.1f} fps)')
+
+
 def plot_json():
+    from matplotlib import pyplot as plt
+
     with open(f'data/models/gestures/{gesture}.json', 'r') as f:
         data = json.load(f)
 
@@ -86,22 +279,230 @@ def plot_json():
     plt.show()
 
 
-def compare():
-    with open(f'data/models/gestures/{gesture}.json', 'r') as f:
-        model = json.load(f)
-
-    history = record(gesture, '2')
-    landmark_ids = {int(idx) for idx in model.keys()}
-    processed = process_landmarks(history, include_landmarks=landmark_ids, plot=True)
-
-    distances = []
-    for landmark_id, points in model.items():
-        distance, _ = fastdtw(processed[int(landmark_id)], points, dist=euclidean)
-        # distance = calculate_threshold(points, processed[int(landmark_id)])
-        distances.append(distance)
-
-    print(distances, sum(distances) / len(distances))
+def list_videos(videos_dir: str) -> dict[str, list[str]]:
+    """Paths of the videos in each gesture sub-directory of videos_dir, keyed by gesture name"""
+    videos = {}
+    for gesture_name in sorted(os.listdir(videos_dir)):
+        if os.path.isdir(gesture_dir := os.path.join(videos_dir, gesture_name)):
+            videos[gesture_name] = [os.path.join(gesture_dir, file) for file in sorted(os.listdir(gesture_dir))
+                                    if file.lower().endswith(VIDEO_EXTENSIONS)]
+
+    return videos
+
+
+def evaluate_video(gesture_name: str, path: str, cache: LandmarkCache = None, mode: str = 'dtw'):
+    """
+    Replay a single video through GestureTracker in a batch worker.
+
+    :param gesture_name: name of the gesture performed in the video
+    :param path: path of the video
+    :param cache: cache of the landmarks extracted from videos
+    :param mode: matching mode of the tracker, see GestureTracker
+    :return: tuple of (gesture name, path, detections as (frame, name) pairs, frames, inference seconds,
+             matching seconds)
+    """
+    global worker_tracker
+    if worker_tracker is None:
+        # Every template is loaded, so that a video can be confused with any other gesture
+        worker_tracker = GestureTracker(camera=None, mode=mode, gestures=None)
+
+    start = time.perf_counter()
+    landmarks = load_landmarks(path, worker_pose, display=False, cache=cache)
+    inference_seconds = time.perf_counter() - start
+
+    # Every video starts from an empty history, as if the tracker was just started
+    start = time.perf_counter()
+    worker_tracker.clear_history()
+    detections = worker_tracker.replay(landmarks)
+
+    return gesture_name, path, detections, len(landmarks), inference_seconds, time.perf_counter() - start
+
+
+def evaluate(videos_dir: str = 'data/videos', workers: int = None, cache: bool = True, report: str = None,
+             mode: str = 'dtw'):
+    """
+    Replay every video under videos_dir/<gesture>/ through the live detection logic, without any display,
+    and print a confusion matrix of the first gesture detected in each video.
+    Videos in a directory named after no template, e.g. "none", are negatives.
+    If videos_dir holds an ANNOTATIONS_FILE, the latency of a detection is counted from the last annotated
+    frame of the gesture, otherwise only the frame of the detection from the start of the video is reported.
+
+    :param videos_dir: directory with one sub-directory of videos per gesture
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param cache: whether to reuse the landmarks cached by earlier runs
+    :param report: JSON file to write the per-video results and the confusion matrix to
+    :param mode: matching mode of the tracker, see GestureTracker
+    :return: the confusion matrix as {true gesture: {predicted gesture: videos}}
+    """
+    videos = list_videos(videos_dir)
+    annotations_path = os.path.join(videos_dir, ANNOTATIONS_FILE)
+    annotations = (load_json(annotations_path) if os.path.isfile(annotations_path) else None) or {}
+    landmark_cache = LandmarkCache() if cache else None
+    start = time.perf_counter()
+    total_frames = 0
+    matching_seconds = 0.0
+    results = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = [executor.submit(evaluate_video, gesture_name, path, landmark_cache, mode)
+                   for gesture_name, paths in videos.items() for path in paths]
+
+        for future in as_completed(futures):
+            gesture_name, path, detections, frames, inference, matching = future.result()
+            total_frames += frames
+            matching_seconds += matching
+
+            predicted = detections[0][1] if detections else 'none'
+            detection_frame = detections[0][0] if detections else None
+            annotation = annotations.get(os.path.relpath(path, videos_dir).replace(os.sep, '/'))
+            # Frames from the end of the gesture to its detection, negative if detected before it ended
+            latency = detection_frame - annotation[1] if annotation and detection_frame is not None else None
+            results.append({'path': path, 'gesture': gesture_name, 'predicted': predicted,
+                            'detection_frame': detection_frame, 'annotation': annotation, 'latency_frames': latency,
+                            'detections': detections, 'frames': frames})
+
+            after = f' ({latency:+d} from the gesture end)' if latency is not None else ''
+            print(f'{path}: {predicted} at frame {detection_frame}{after}, {len(detections)} detection(s), '
+                  f'{frames} frames, {frames / (matching or 1):.0f} fps matching, '
+                  f'{frames / (inference or 1):.1f} fps landmarks')
+
+    seconds = time.perf_counter() - start
+    labels = sorted({result['gesture'] for result in results} | {result['predicted'] for result in results})
+    confusion = {true: {predicted: 0 for predicted in labels} for true in labels}
+    for result in results:
+        confusion[result['gesture']][result['predicted']] += 1
+
+    width = max([len(label) for label in labels] + [9])
+    print(f'\n{"true/got":<{width}} ' + ' '.join(f'{label:>{width}}' for label in labels))
+    for true in labels:
+        print(f'{true:<{width}} ' + ' '.join(f'{confusion[true][predicted]:>{width}}' for predicted in labels))
+
+    correct = sum(result['gesture'] == result['predicted'] for result in results)
+    hits = [result for result in results if result['gesture'] == result['predicted'] and result['detections']]
+    latencies = [result['latency_frames'] for result in hits if result['latency_frames'] is not None]
+    print(f'\nAccuracy: {correct} of {len(results)} videos')
+    if latencies:
+        print(f'Detection latency from the gesture end: median {np.median(latencies):+.0f} frames, '
+              f'max {max(latencies):+d} frames, over {len(latencies)} annotated videos')
+    elif hits:
+        frames_in = [result['detection_frame'] for result in hits]
+        print(f'Detection frame from the video start (no {ANNOTATIONS_FILE}): median {np.median(frames_in):.0f}, '
+              f'max {max(frames_in)}')
+    print(f'{total_frames} frames in {seconds:.2f}s ({total_frames / (seconds or 1):.1f} fps overall, '
+          f'{total_frames / (matching_seconds or 1):.0f} fps matching per worker)')
+
+    if report:
+        with open(report, 'w') as f:
+            json.dump({'videos': sorted(results, key=lambda result: result['path']), 'confusion': confusion}, f,
+                      indent=4)
+
+    return confusion
+
+
+def score_video(gesture_name: str, path: str, cache: LandmarkCache = None):
+    """
+    Replay a single video through GestureTracker in compiled mode in a batch worker, keeping the scores
+    of every compiled template instead of detecting gestures.
+
+    :param gesture_name: name of the gesture performed in the video
+    :param path: path of the video
+    :param cache: cache of the landmarks extracted from videos
+    :return: tuple of (gesture name, names of the compiled templates, numpy array of shape (frames, templates)
+             with the best score of every template in each frame that was matched)
+    """
+    global worker_tracker
+    if worker_tracker is None:
+        worker_tracker = GestureTracker(camera=None, mode='compiled', gestures=None)
+        # A detection would clear the history, so nothing is allowed to match
+        worker_tracker.compiled_thresholds[:] = -np.inf
+
+    landmarks = load_landmarks(path, worker_pose, display=False, cache=cache)
+    worker_tracker.clear_history()
+    scores = []
+    for frame_landmarks in landmarks:
+        # The live loop skips frames without a pose
+        if np.isnan(frame_landmarks[0, 0]):
+            continue
+
+        worker_tracker.set_focus_points(frame_landmarks)
+        worker_tracker.compiled_scores[:] = np.inf
+        worker_tracker.update()
+        if np.isfinite(worker_tracker.compiled_scores).any():
+            scores.append(worker_tracker.compiled_scores.copy())
+
+    names = worker_tracker.compiled.names
+    return gesture_name, names, np.reshape(scores, (-1, len(names)))
+
+
+def calibrate_compiled(videos_dir: str = 'data/videos', workers: int = None, cache: bool = True,
+                       output: str = COMPILED_THRESHOLDS_PATH, percentile: float = COMPILED_PERCENTILE):
+    """
+    Calibrate the threshold of every compiled template on recorded negatives: the videos under videos_dir
+    of any other gesture, including "none". The threshold is a low percentile of the scores of the template
+    on those videos, so that about that share of the frames matched in them would be false positives.
+
+    :param videos_dir: directory with one sub-directory of videos per gesture
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param cache: whether to reuse the landmarks cached by earlier runs
+    :param output: JSON file to write the thresholds to, read by GestureTracker in compiled mode
+    :param percentile: percentile of the negative scores used as threshold
+    :return: the thresholds keyed by gesture name
+    """
+    videos = list_videos(videos_dir)
+    landmark_cache = LandmarkCache() if cache else None
+    negatives = {}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = [executor.submit(score_video, gesture_name, path, landmark_cache)
+                   for gesture_name, paths in videos.items() for path in paths]
+
+        for future in as_completed(futures):
+            gesture_name, names, scores = future.result()
+            for index, name in enumerate(names):
+                if name != gesture_name:
+                    column = scores[:, index]
+                    negatives.setdefault(name, []).extend(column[np.isfinite(column)])
+
+    thresholds = {}
+    for name, scores in sorted(negatives.items()):
+        if not scores:
+            print(f'{name}: no negative frames were matched, no threshold')
+            continue
+
+        thresholds[name] = float(np.percentile(scores, percentile))
+        print(f'{name}: {thresholds[name]:.4f} from {len(scores)} negative frames, lowest {min(scores):.4f}')
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(thresholds, f, indent=4)
+    print(f'Saved thresholds to {output}')
+
+    return thresholds
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Record gesture templates from videos.')
+    parser.add_argument('--batch', action='store_true', help='build templates from every video, without display')
+    parser.add_argument('--workers', type=int, default=None, help='number of batch worker processes')
+    parser.add_argument('--videos', default='data/videos', help='directory with one sub-directory per gesture')
+    parser.add_argument('--output', default='data/models/gestures', help='directory to write the templates to')
+    parser.add_argument('--no-cache', action='store_true', help='run inference even if landmarks are cached')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='replay every video through the gesture tracker and print a confusion matrix')
+    parser.add_argument('--report', help='JSON file to write the evaluation results to')
+    parser.add_argument('--calibrate-compiled', action='store_true',
+                        help='calibrate the thresholds of the compiled mode on the videos of other gestures')
+    parser.add_argument('--dims', type=int, default=2, choices=(2, 3),
+                        help='build and evaluate (x, y) or (x, y, z) templates')
+    args = parser.parse_args()
+
+    if args.calibrate_compiled:
+        calibrate_compiled(videos_dir=args.videos, workers=args.workers, cache=not args.no_cache)
+    elif args.evaluate:
+        evaluate(videos_dir=args.videos, workers=args.workers, cache=not args.no_cache, report=args.report,
+                 mode='dtw3d' if args.dims == 3 else 'dtw')
+    elif args.batch:
+        build_templates(videos_dir=args.videos, models_dir=args.output, workers=args.workers,
+                        cache=not args.no_cache, dims=args.dims)
+    else:
+        main()
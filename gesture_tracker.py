@@ -1,54 +1,225 @@
-import json
+import argparse
 import os
-import time
-from collections import deque
+from collections import Counter
 
 import cv2
-from fastdtw import fastdtw
-from pynput.mouse import Controller
-from pynput.keyboard import Key, Controller as KeyboardController
-from scipy.spatial.distance import euclidean
-
-from pose_recorder import mp_drawing
-from utils.config import FOCUS_POINTS, mp_pose
+import numpy as np
+
+from utils import config
+from utils.capture import ThreadedCapture
+from utils.compiled_templates import CompiledTemplates
+from utils.config import FOCUS_LANDMARK_IDS, drawing_spec
+from utils.dtw import dtw_early_abandon, envelope, lb_keogh, lb_kim_batch
+from utils.dispatcher import ActionDispatcher, load_bindings
 from utils.fps_tracker import FPSTracker
-from utils.tracker_2d import process_landmarks
+from utils.frame_pipeline import FramePipeline
+from utils.landmarks import empty_landmarks, to_landmark_list, write_landmarks
+from utils.overlay import REFRESH_INTERVAL, Overlay
+from utils.ring_buffer import PointRingBuffer
+from utils.roi import RegionOfInterest
+from utils.stage_timer import StageTimer
+from utils.spotting import RunningMean, SpringSpotter, stack_template
+from utils.template_store import TemplateLibrary, load_json
+from utils.tracker_2d import preprocess_windows, resample_batch, simplify_windows
 
 BUFFER_SIZE = 25
+# Lengths in frames of the windows matched every frame, so that faster and slower performances are found too
+WINDOW_SIZES = (15, BUFFER_SIZE, 40)
 MOVE_MOUSE = False
+# Fraction of the smallest template spread a landmark has to cover within a window before matching runs
+MOTION_FRACTION = 0.25
+# Fraction of the score of a compiled template against itself reversed below which it matches, for gestures
+# without a threshold calibrated on recorded negatives. Only tuned on synthetic punches, which score up to 0.36
+# of it when performed in 12 to 40 frames, and from 0.44 when performed backwards
+COMPILED_FRACTION = 0.4
+# Thresholds of the compiled templates calibrated by gesture_recorder.py --calibrate-compiled, keyed by gesture
+COMPILED_THRESHOLDS_PATH = 'data/models/compiled_thresholds.json'
+# Mean distance per landmark and frame of the stretched template below which a spotted gesture matches. Synthetic
+# punches performed in 12 to 40 frames cost up to 0.050, the same punches performed backwards from 0.055
+SPRING_FRAME_COST = 0.05
+BINDINGS_PATH = 'data/bindings.json'
+# Gestures matched live; evaluation and calibration load every template
+LIVE_GESTURES = ('punch',)
+POSE_SETTINGS = {
+    'model_complexity': 0,
+    'min_detection_confidence': 0.5,
+    'min_tracking_confidence': 0.5
+}
 
 
 class GestureTracker:
-    def __init__(self, camera: int = 0):
+    def __init__(self, camera: int = 0, mode: str = 'dtw', timer: StageTimer = None, use_roi: bool = False,
+                 window_sizes: tuple[int, ...] = WINDOW_SIZES, gestures: tuple[str, ...] = LIVE_GESTURES):
         """
         Initialize the recorder.
 
-        :param camera: camera ID to use
+        :param camera: camera ID to use, None to run the matching without a camera, e.g. in benchmarks
+        :param mode: 'dtw' to match the whole buffer every frame, 'spring' to spot gestures incrementally,
+            'compiled' to score the buffer against every gesture resampled to a fixed length at once, experimental:
+            it misses more gestures than 'dtw' and its thresholds need calibrating on recorded negatives,
+            'dtw3d' to match like 'dtw' with the depth of the world landmarks, against 3D templates
+        :param timer: per-stage timer of the live loop, disabled if None
+        :param use_roi: whether to run inference on a crop around the previous frame's pose instead of the whole frame
+        :param window_sizes: lengths in frames of the windows matched in 'dtw', 'dtw3d' and 'compiled' modes,
+            all cut from one history of the longest length
+        :param gestures: names of the gestures to match, None to match every template
         """
-        self.capture = cv2.VideoCapture(camera)
-        self.point_history = {num.value: deque(maxlen=BUFFER_SIZE) for num in FOCUS_POINTS}
+        self.capture = ThreadedCapture(camera) if camera is not None else None
+        self.timer = timer or StageTimer()
+        # The pose is only searched for in the whole frame once it is lost, see RegionOfInterest
+        self.roi = RegionOfInterest(refresh_interval=None) if use_roi else None
+        self.overlay = Overlay()
+        self.landmarks = empty_landmarks('pose')
+        self.dims = 3 if mode == 'dtw3d' else 2
+        self.window_sizes = tuple(sorted(window_sizes))
+        self.point_history = PointRingBuffer(self.window_sizes[-1], FOCUS_LANDMARK_IDS, dims=self.dims)
+        self.frame_points = np.zeros((len(FOCUS_LANDMARK_IDS), self.dims), dtype=np.float32)
+        self.frame_visible = np.zeros(len(FOCUS_LANDMARK_IDS), dtype=bool)
         self.color_keep = 0
         self.detected = ''
-        self.mouse = Controller()
-        self.keyboard = KeyboardController()
-
-        self.gestures = self.load_gestures()
+        self.detection_count = 0
+        self.dispatcher = ActionDispatcher(load_bindings(BINDINGS_PATH)) if MOVE_MOUSE else None
+
+        self.gestures = self.load_gestures(gestures, dims=self.dims, window_sizes=self.window_sizes)
+        self.required_landmarks = sorted({int(idx) for gesture in self.gestures for idx in gesture['points'].keys()})
+
+        self.mode = mode
+        self.spotters = self.build_spotters(self.gestures) if mode == 'spring' else []
+        self.compiled = CompiledTemplates(self.gestures, self.required_landmarks) if mode == 'compiled' else None
+        self.compiled_thresholds = self.get_compiled_thresholds(self.compiled) if self.compiled else None
+        self.compiled_scores = np.full(len(self.gestures), np.inf)
+        # Sums of visibility, visible points and their squares, for the spread of every landmark over each window
+        self.motion = {window: RunningMean(window, (len(FOCUS_LANDMARK_IDS), 1 + 2 * self.dims))
+                       for window in self.window_sizes}
+        self.motion_rows = [FOCUS_LANDMARK_IDS.index(landmark_id) for landmark_id in self.required_landmarks]
+        self.motion_threshold = self.get_motion_threshold(self.gestures)
+        self.motion_spread = {window: np.zeros(len(FOCUS_LANDMARK_IDS)) for window in self.window_sizes}
+        self.gated_frames = 0
+        self.last_match = None
+        self.cascade_stats = Counter()
 
     @staticmethod
-    def load_gestures():
-        gestures = []
-        include = ["punch"]
-        for file in os.listdir("data/models/gestures"):
-            if file.endswith(".json") and file[:-5] in include:
-                with open(os.path.join("data/models/gestures", file), "r") as f:
-                    points = json.load(f)
-                    gestures.append({
-                        "name": points.get('name') or file[:-5],
-                        "points": points.get('points') or points
+    def load_gestures(include: tuple[str, ...] = LIVE_GESTURES, dims: int = 2,
+                      window_sizes: tuple[int, ...] = WINDOW_SIZES):
+        library = TemplateLibrary()
+        if library.exists:
+            loaded = library.gestures()
+        else:
+            loaded = []
+            for file in os.listdir("data/models/gestures"):
+                if file.endswith(".json") and (data := load_json(os.path.join("data/models/gestures", file))):
+                    loaded.append({
+                        "name": data.get('name') or file[:-5],
+                        "points": data['points'] if 'points' in data else data,
+                        "duration": data.get('duration')
                     })
 
+        gestures = []
+        for gesture in loaded:
+            # Templates built from several videos of a gesture share its name
+            if include is not None and gesture['name'] not in include:
+                continue
+
+            # A video in which no landmark moved enough leaves an empty template
+            if not gesture['points']:
+                continue
+
+            # 2D and 3D templates of a gesture can sit side by side
+            if any(np.shape(points)[-1] != dims for points in gesture['points'].values()):
+                continue
+
+            gestures.append(GestureTracker.prepare_templates(gesture, window_sizes))
+
         return gestures
 
+    @staticmethod
+    def prepare_templates(gesture: dict, window_sizes: tuple[int, ...] = WINDOW_SIZES) -> dict:
+        """
+        Keep each template of the gesture as an array with its envelope for the lower bounds in detect_gesture,
+        along with the window lengths its duration allows.
+
+        :param gesture: gesture with its points, and optionally the (shortest, longest) duration in frames
+            it is performed in, as stored under "duration" in its template
+        :param window_sizes: window lengths of the tracker
+        :return: the gesture
+        """
+        gesture['templates'] = []
+        for idx, template in gesture['points'].items():
+            template = np.asarray(template)
+            gesture['templates'].append((int(idx), template, *envelope(template)))
+
+        # The first and last points of every template, to bound it against every window at once
+        gesture['ends'] = (np.array([idx for idx, _, _, _ in gesture['templates']], dtype=int),
+                           np.array([template[[0, -1]] for _, template, _, _ in gesture['templates']]),
+                           np.array([len(template) for _, template, _, _ in gesture['templates']]))
+        gesture['windows'] = GestureTracker.get_gesture_windows(gesture.get('duration'), window_sizes)
+        return gesture
+
+    @staticmethod
+    def get_gesture_windows(duration, window_sizes: tuple[int, ...]) -> list[int]:
+        """
+        Select the window lengths a gesture is matched at.
+
+        :param duration: (shortest, longest) number of frames the gesture is performed in, None if unknown
+        :param window_sizes: window lengths of the tracker
+        :return: the window lengths within the duration, the closest one if none is, all of them without a duration
+        """
+        if not duration:
+            return list(window_sizes)
+
+        shortest, longest = duration
+        windows = [window for window in window_sizes if shortest <= window <= longest]
+        return windows or [min(window_sizes, key=lambda window: max(shortest - window, window - longest))]
+
+    @staticmethod
+    def get_motion_threshold(gestures) -> float:
+        """
+        Spread a landmark has to cover within a window before the history is worth matching.
+
+        :param gestures: gestures loaded by load_gestures
+        :return: MOTION_FRACTION of the smallest spread of the most moving landmark of any gesture, the spread of
+            a template being the root of the summed variances of its points, resampled at a steady speed
+        """
+        spreads = []
+        for gesture in gestures:
+            templates = [resample_batch(np.asarray(points, dtype=float)[np.newaxis], BUFFER_SIZE)[0]
+                         for points in gesture['points'].values()]
+            if templates:
+                spreads.append(max(np.sqrt(np.sum(np.var(template, axis=0))) for template in templates))
+        return MOTION_FRACTION * min(spreads) if spreads else 0.0
+
+    @staticmethod
+    def get_compiled_thresholds(compiled: CompiledTemplates, path: str = COMPILED_THRESHOLDS_PATH) -> np.ndarray:
+        """
+        Score below which each compiled template matches.
+
+        :param compiled: the compiled templates
+        :param path: JSON file of the thresholds calibrated on recorded negatives, keyed by gesture name
+        :return: the calibrated threshold of every gesture, COMPILED_FRACTION of its reversed score if it has none
+        """
+        calibrated = (load_json(path) if os.path.isfile(path) else None) or {}
+        fallback = COMPILED_FRACTION * compiled.reversed_scores()
+        return np.array([calibrated.get(name, default) for name, default in zip(compiled.names, fallback)])
+
+    @staticmethod
+    def build_spotters(gestures):
+        """
+        Create a streaming spotter for every gesture, with all of its landmarks matched together.
+
+        :param gestures: gestures loaded by load_gestures
+        :return: list of (gesture name, indices into FOCUS_LANDMARK_IDS, spotter)
+        """
+        spotters = []
+        for gesture in gestures:
+            landmark_ids = list(gesture['points'].keys())
+            indices = [FOCUS_LANDMARK_IDS.index(int(idx)) for idx in landmark_ids]
+            template = stack_template(gesture['points'], landmark_ids, length=BUFFER_SIZE)
+
+            epsilon = SPRING_FRAME_COST * len(template) * len(indices)
+            spotters.append((gesture['name'], indices, SpringSpotter(template, epsilon)))
+
+        return spotters
+
     @property
     def color(self) -> tuple[int, int, int]:
         """
@@ -63,141 +234,267 @@ class GestureTracker:
         self.detected = ''
         return 0, 0, 255
 
-    def draw_landmarks(self, frame, results):
+    def draw_landmarks(self, frame, landmarks: np.ndarray, mirror: bool = False):
         """
         Draw the landmarks on the frame.
 
         :param frame: frame to draw on
-        :param results: results from the mediapipe hands module
+        :param landmarks: numpy array of shape (33, 4) with the image landmarks of the pose
+        :param mirror: whether the frame is mirrored
         :return:
         """
         color = self.color
-        mp_drawing.draw_landmarks(
+        config.mp_drawing.draw_landmarks(
             image=frame,
-            landmark_list=results.pose_landmarks,
-            connections=mp_pose.POSE_CONNECTIONS,
-            landmark_drawing_spec=mp_drawing.DrawingSpec(color=color, thickness=2, circle_radius=2),
-            connection_drawing_spec=mp_drawing.DrawingSpec(color=color, thickness=2, circle_radius=2)
+            landmark_list=to_landmark_list(landmarks, mirror=mirror),
+            connections=config.mp_pose.POSE_CONNECTIONS,
+            landmark_drawing_spec=drawing_spec(color),
+            connection_drawing_spec=drawing_spec(color)
         )
 
     def draw_info(self, image, fps: int):
-        cv2.putText(image, 'FPS:' + str(fps), (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                    1.0, (0, 0, 0), 4, cv2.LINE_AA)
-        cv2.putText(image, "FPS:" + str(fps), (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                    1.0, (255, 255, 255), 2, cv2.LINE_AA)
-
-        cv2.putText(image, f'Gesture: {self.detected or None}', (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 0, 0), 4,
-                    cv2.LINE_AA)
-        cv2.putText(image, f'Gesture: {self.detected or None}', (10, 90),
-                    cv2.FONT_HERSHEY_SIMPLEX, 2.0, (255, 255, 255), 2,
-                    cv2.LINE_AA)
+        self.overlay.text('fps', 'FPS:' + str(fps), (10, 30), 1.0, interval=REFRESH_INTERVAL)
+        self.overlay.text('gesture', f'Gesture: {self.detected or None}', (10, 90), 2.0)
 
-        return image
+        return self.overlay.draw(image)
 
-    @staticmethod
-    def get_centre_point(results, num):
-        landmark = results.pose_world_landmarks.landmark[num]
+    def set_focus_points(self, landmarks: np.ndarray):
+        """
+        Fill frame_points and frame_visible with the focus points of the current frame.
+        Focus points seen with a visibility below 0.7 are left at 0 and not visible.
 
-        if landmark.visibility < 0.7:
-            return 0, 0
+        :param landmarks: numpy array of shape (33, 4) with the x, y, z and visibility of every world landmark
+        :return:
+        """
+        focus = landmarks[FOCUS_LANDMARK_IDS]
+        self.frame_points[:] = np.where(focus[:, 3:] >= 0.7, focus[:, :self.dims], 0)
+        self.frame_visible[:] = self.frame_points.any(axis=1)
+
+    def update(self):
+        """Match the history of the previous frames, then add the focus points of the current frame to it"""
+        if self.mode != 'spring' and len(self.point_history) >= self.window_sizes[0]:
+            windows = self.get_windows()
+            if not windows:
+                # Nothing moved enough to perform any gesture, so matching is skipped
+                self.gated_frames += 1
+            elif self.mode in ('dtw', 'dtw3d'):
+                self.detect_gesture(windows)
+            elif self.mode == 'compiled':
+                self.match_compiled(windows)
+            self.timer.lap('matching')
+
+        self.track_motion()
+        self.point_history.append(self.frame_points, self.frame_visible)
+        self.timer.lap('landmarks')
+
+        if self.mode == 'spring':
+            self.spot_gesture()
+            self.timer.lap('matching')
+
+    def get_windows(self) -> list[int]:
+        """Window lengths that fit in the history and over which a required landmark moved enough for a gesture"""
+        return [window for window in self.window_sizes if window <= len(self.point_history)
+                and np.any(self.motion_spread[window][self.motion_rows] >= self.motion_threshold)]
+
+    def track_motion(self):
+        """
+        Add the points of the current frame to the spread of every landmark over each window.
+
+        The spread is the root of the summed variances of the visible points. Unlike the length of the path,
+        it does not grow with the number of frames the landmark jitters in place.
+        """
+        visible = self.frame_visible[:, np.newaxis].astype(float)
+        points = self.frame_points * visible
+        sample = np.concatenate((visible, points, points * self.frame_points), axis=1)
+        for window, motion in self.motion.items():
+            count, total, squares = np.split(motion.update(sample), [1, 1 + self.dims], axis=1)
+            # A landmark appearing or disappearing at (0, 0) is left out rather than counted as a jump
+            count = np.maximum(count, 1e-9)
+            variance = np.maximum(squares / count - (total / count) ** 2, 0)
+            self.motion_spread[window] = np.sqrt(np.sum(variance, axis=1))
+
+    def replay(self, landmarks: np.ndarray) -> list[tuple[int, str]]:
+        """
+        Run recorded landmarks through the same steps as the live loop, without a camera or a window.
+
+        :param landmarks: numpy array of shape (frames, 33, 4) as cached by gesture_recorder.py, NaN without a pose
+        :return: list of (frame index, gesture name) for every detection
+        """
+        detections = []
+        for frame, frame_landmarks in enumerate(landmarks):
+            # The live loop skips frames without a pose
+            if np.isnan(frame_landmarks[0, 0]):
+                continue
+
+            self.set_focus_points(frame_landmarks)
+            self.detected = ''
+            self.update()
+            if self.detected:
+                detections.append((frame, self.detected))
+
+        return detections
+
+    def detect_gesture(self, windows: list[int] = None):
+        """
+        Match the newest frames against every gesture, at each window length its duration allows.
+
+        :param windows: window lengths to match, all of those that fit in the history if None
+        :return:
+        """
+        if not self.gestures:
+            return
+
+        if windows is None:
+            windows = [window for window in self.window_sizes if window <= len(self.point_history)]
+
+        # Every gesture compares against the same processed windows, which share one smoothing of the history
+        processed = preprocess_windows(self.point_history.history(self.required_landmarks), self.required_landmarks,
+                                       windows)
+
+        candidates = []
+        for window, landmarks in processed.items():
+            queries = {landmark_id: np.reshape(points, (-1, self.dims)) for landmark_id, points in landmarks.items()}
+            if any(np.count_nonzero(np.all(points == 0, axis=1)) > window / 2 for points in queries.values()):
+                continue
+
+            query_envelopes = {landmark_id: envelope(points) for landmark_id, points in queries.items()}
+            candidates.append((window, queries, query_envelopes))
+
+        if not candidates:
+            return
 
-        return landmark.x, landmark.y
+        # First and last point of every query by window and landmark id, to bound each gesture in all windows at once
+        query_ends = np.zeros((len(candidates), max(self.required_landmarks) + 1, 2, self.dims))
+        query_lengths = np.zeros(query_ends.shape[:2], dtype=int)
+        for row, (_, queries, _) in enumerate(candidates):
+            for landmark_id, points in queries.items():
+                query_ends[row, landmark_id] = points[[0, -1]]
+                query_lengths[row, landmark_id] = len(points)
 
-    def detect_gesture(self):
         scores = []
+        best = np.inf
         for gesture in self.gestures:
-            landmark_ids = {int(idx) for idx in gesture['points'].keys()}
-            processed = process_landmarks(self.point_history, include_landmarks=landmark_ids)
-
-            distances = []
-            for landmark_id, points in gesture['points'].items():
-                count = 0
-                for coord in processed[int(landmark_id)]:
-                    if coord[0] == 0 and coord[1] == 0:
-                        count += 1
-                        if count > BUFFER_SIZE / 2:
-                            break
-                if count > BUFFER_SIZE / 2:
-                    return
-
-                distance, _ = fastdtw(processed[int(landmark_id)], points, dist=euclidean)
-                distances.append(distance)
-
-            mean = sum(distances) / len(distances)
-            # print(gesture['name'], distances, mean)
-            threshold = 0.15 + 0.15 * len(distances)
-            if mean < threshold:
-                scores.append((gesture['name'], mean))
+            rows = [row for row, (window, *_) in enumerate(candidates) if window in gesture['windows']]
+            if not rows:
+                continue
+
+            landmark_ids, template_ends, template_lengths = gesture['ends']
+            bounds = lb_kim_batch(query_ends[rows][:, landmark_ids], query_lengths[rows][:, landmark_ids],
+                                  template_ends, template_lengths)
+
+            for row, window_bounds in zip(rows, bounds):
+                _, queries, query_envelopes = candidates[row]
+                # The best score of any gesture and window so far prunes the following ones
+                mean = self.score_gesture(gesture, queries, query_envelopes, window_bounds.tolist(), best)
+                if mean is not None:
+                    scores.append((gesture['name'], mean))
+                    best = min(best, mean)
 
         if scores:
             scores.sort(key=lambda x: x[1])
-            self.color_keep = 10
-            self.detected = scores[0][0]
-            # print(self.detected, scores[0][1])
-            # self.handle_input()
-            if self.detected != 'front_stroke':
-                self.clear_history()
+            # print(scores[0][0], scores[0][1])
+            self.set_detected(scores[0][0])
+
+    def score_gesture(self, gesture: dict, queries: dict, query_envelopes: dict, bounds: list[float], best: float):
+        """
+        Run a gesture through the cascade of lower bounds before computing its exact distance to a window.
+
+        :param gesture: gesture prepared by prepare_templates
+        :param queries: simplified points of the window for each landmark id, as arrays
+        :param query_envelopes: envelope of each query
+        :param bounds: lb_kim of each template of the gesture against its query
+        :param best: best score found so far this frame
+        :return: mean distance over the landmarks of the gesture if it is detected and below best, None otherwise
+        """
+        self.cascade_stats['candidates'] += 1
+        templates = gesture['templates']
+
+        # A gesture can only be detected if its mean distance is below the threshold and the best score so far
+        cutoff = len(templates) * min(0.15 + 0.15 * len(templates), best)
+
+        if sum(bounds) >= cutoff:
+            self.cascade_stats['lb_kim'] += 1
+            return None
+
+        bounds = [max(bound, lb_keogh(queries[idx], lower, upper), lb_keogh(template, *query_envelopes[idx]))
+                  for bound, (idx, template, lower, upper) in zip(bounds, templates)]
+        if sum(bounds) >= cutoff:
+            self.cascade_stats['lb_keogh'] += 1
+            return None
+
+        # Replace the bounds by exact distances one landmark at a time, abandoning once the cutoff is reached
+        total = sum(bounds)
+        for bound, (idx, template, _, _) in zip(bounds, templates):
+            total += dtw_early_abandon(queries[idx], template, cutoff - total + bound) - bound
+            if total >= cutoff:
+                self.cascade_stats['dtw_abandoned'] += 1
+                return None
+
+        # Every bound was replaced, so the total is the exact distance, already below the threshold
+        self.cascade_stats['matched'] += 1
+        return total / len(templates)
+
+    def match_compiled(self, windows: list[int]):
+        """Score each window against every compiled template with one array expression"""
+        if not self.gestures:
+            return
+
+        rows = [self.point_history.rows[landmark_id] for landmark_id in self.required_landmarks]
+        hidden = ~self.point_history.visible_view()[:, rows]
+        windows = [window for window in windows if not np.any(np.count_nonzero(hidden[-window:], axis=0) > window / 2)]
+        if not windows:
+            return
+
+        scores = np.full((len(windows), len(self.gestures)), np.inf)
+        simplified = simplify_windows(self.point_history.history(self.required_landmarks), windows)
+        for row, (window, (smoothed, masks)) in enumerate(simplified.items()):
+            allowed = [window in gesture['windows'] for gesture in self.gestures]
+            scores[row, allowed] = self.compiled.score(resample_batch(smoothed, self.compiled.length, masks))[allowed]
+
+        # Kept for calibrating the thresholds, see gesture_recorder.calibrate_compiled
+        self.compiled_scores = scores.min(axis=0)
+        best = int(np.argmin(self.compiled_scores))
+        if self.compiled_scores[best] < self.compiled_thresholds[best]:
+            self.set_detected(self.compiled.names[best])
+
+    def spot_gesture(self):
+        """Feed the newest points to the streaming spotters and report the best finished match."""
+        points = self.point_history.latest()
+        visible = self.point_history.visible_view()[-1]
+
+        matches = []
+        for name, indices, spotter in self.spotters:
+            match = spotter.update(points[indices] if visible[indices].all() else None)
+            if match is not None:
+                distance, start, end = match
+                matches.append((distance / len(indices), name, start, end))
+
+        if matches:
+            _, name, start, end = min(matches)
+            self.last_match = (name, start, end)
+            self.set_detected(name)
+
+    def set_detected(self, name: str):
+        self.color_keep = 10
+        self.detected = name
+        self.detection_count += 1
+        if self.dispatcher is not None:
+            self.handle_input()
+        if self.detected != 'front_stroke':
+            self.clear_history()
 
     def clear_history(self):
-        for k in self.point_history.keys():
-            self.point_history[k].clear()
+        self.point_history.clear()
+        for window, motion in self.motion.items():
+            motion.reset()
+            self.motion_spread[window][:] = 0
+
+        for _, _, spotter in self.spotters:
+            spotter.reset()
 
     def handle_input(self):
         """Before you freak out, this is just for testing."""
-        if self.detected == 'baseball_swing':
-            self.mouse.position = (1100, 800)
-            time.sleep(0.03)
-
-            # Drag mouse to the left with deceleration
-            for i in range(60, 25, -1):
-                self.mouse.move(-i, -i)
-                time.sleep(0.01)
-
-        elif self.detected == 'tennis_swing':
-            # Drag mouse to the left with deceleration
-            self.mouse.position = (1200, 400)
-            time.sleep(0.03)
-
-            for i in range(60, 25, -1):
-                self.mouse.move(-i, -i // 2)
-                time.sleep(0.01)
-
-        elif self.detected == 'back_swing':
-            # Drag mouse to the right with deceleration
-            self.mouse.position = (400, 400)
-            time.sleep(0.03)
-
-            for i in range(60, 25, -1):
-                self.mouse.move(i, -i // 2)
-                time.sleep(0.01)
-
-        elif self.detected == 'serve':
-            self.keyboard.press('i')
-            time.sleep(0.03)
-            self.keyboard.release('i')
-
-            self.keyboard.press('s')
-            time.sleep(0.03)
-            self.keyboard.release('s')
-
-            self.keyboard.press('i')
-            time.sleep(0.03)
-            self.keyboard.release('i')
-
-            self.keyboard.press('s')
-            time.sleep(0.03)
-            self.keyboard.release('s')
-
-        elif self.detected == 'punch':
-            self.keyboard.press(Key.enter)
-            time.sleep(0.04)
-            self.keyboard.release(Key.enter)
-
-        elif self.detected == 'punch_left':
-            self.keyboard.press('a')
-            time.sleep(0.04)
-            self.keyboard.release('a')
+        self.dispatcher.dispatch(self.detected)
 
     @staticmethod
     def handle_key(key: int) -> bool:
@@ -212,6 +509,50 @@ class GestureTracker:
 
         return False
 
+    def process_frame(self, frame, pose, display: bool = True, fps: float = 0):
+        """
+        Run pose inference on a frame and match the focus points against the gestures.
+
+        :param frame: BGR frame to process
+        :param pose: mediapipe pose instance to run on the frame
+        :param display: whether to draw the annotated frame
+        :param fps: frame rate to show on the annotated frame
+        :return: the annotated, mirrored frame if display, None otherwise
+        """
+        timer = self.timer
+
+        # To improve performance, mark the image as not writeable to pass by reference
+        frame.flags.writeable = False
+        image = cv2.cvtColor(self.roi.crop(frame) if self.roi is not None else frame, cv2.COLOR_BGR2RGB)
+        timer.lap('convert')
+        results = pose.process(image)
+        frame.flags.writeable = True
+        timer.lap('inference')
+
+        write_landmarks('pose', results, self.landmarks)
+        image_landmarks, world_landmarks = self.landmarks
+        if self.roi is not None:
+            # The world landmarks used for matching do not depend on the crop, only the drawn ones do
+            self.roi.to_frame(image_landmarks)
+            self.roi.update(self.landmarks[:1])
+        timer.lap('landmarks')
+
+        if not np.isnan(world_landmarks[0, 0]):
+            if display:
+                self.draw_landmarks(frame=frame, landmarks=image_landmarks)
+                timer.lap('drawing')
+
+            self.set_focus_points(world_landmarks)
+            timer.lap('landmarks')
+            self.update()
+
+        if not display:
+            return None
+
+        image = timer.draw(self.draw_info(image=cv2.flip(frame, 1), fps=fps))
+        timer.lap('drawing')
+        return image
+
     def run(self, display: bool = True):
         """
         Record gestures and save them when the user presses the "S" key.
@@ -220,38 +561,91 @@ class GestureTracker:
         :return:
         """
 
-        with mp_pose.Pose(
-                model_complexity=0,
-                min_detection_confidence=0.5,
-                min_tracking_confidence=0.5
-        ) as pose:
-            fps_tracker = FPSTracker()
+        with config.mp_pose.Pose(**POSE_SETTINGS) as pose:
+            fps_tracker = FPSTracker(buffer_len=10)
+            timer = self.timer
             while True:
+                timer.start()
                 _, frame = self.capture.read()
+                timer.lap('capture')
 
-                # To improve performance, mark the image as not writeable to pass by reference
-                frame.flags.writeable = False
-                results = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                frame.flags.writeable = True
-
-                if results.pose_landmarks is not None:  # type: ignore
-                    if display:
-                        self.draw_landmarks(frame=frame, results=results)  # type: ignore
-                    if len(self.point_history[list(self.point_history.keys())[0]]) == BUFFER_SIZE:
-                        self.detect_gesture()
-
-                    for num in FOCUS_POINTS:
-                        self.point_history[num.value].append(
-                            self.get_centre_point(results=results, num=num.value))  # type: ignore
+                image = self.process_frame(frame, pose, display=display, fps=fps_tracker.get() if display else 0)
 
                 if display:
-                    cv2.imshow('Gesture Tracker', self.draw_info(image=cv2.flip(frame, 1), fps=fps_tracker.get()))
+                    cv2.imshow('Gesture Tracker', image)
 
                     key = cv2.waitKey(1)
+                    timer.lap('display')
                     if self.handle_key(key=key):
                         break
 
+                timer.end_frame()
+
+        self.capture.release()
+        if self.timer.dump_path:
+            self.timer.dump()
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+
+    def run_pipeline(self, source=0, display: bool = True):
+        """
+        Detect gestures like run, with the camera and the pose inference in processes of their own.
+
+        :param source: camera ID or video path
+        :param display: whether to display the video feed
+        :return:
+        """
+        fps_tracker = FPSTracker(buffer_len=10)
+        timer = self.timer
+        with FramePipeline(source, 'pose', POSE_SETTINGS, use_roi=self.roi is not None) as pipeline:
+            for frame, landmarks in pipeline:
+                timer.start()
+                image_landmarks, world_landmarks = landmarks
+                found = not np.isnan(world_landmarks[0, 0])
+                if found:
+                    self.set_focus_points(world_landmarks)
+                    timer.lap('landmarks')
+                    self.update()
+
+                if not display:
+                    timer.end_frame()
+                    continue
+
+                # The shared frame is read-only, so the landmarks are drawn mirrored onto the mirrored copy
+                image = cv2.flip(frame, 1)
+                if found:
+                    self.draw_landmarks(frame=image, landmarks=image_landmarks, mirror=True)
+                image = timer.draw(self.draw_info(image=image, fps=fps_tracker.get()))
+                timer.lap('drawing')
+                cv2.imshow('Gesture Tracker', image)
+
+                key = cv2.waitKey(1)
+                timer.lap('display')
+                if self.handle_key(key=key):
+                    break
+
+                timer.end_frame()
+
+        cv2.destroyAllWindows()
+        if self.timer.dump_path:
+            self.timer.dump()
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+
 
 if __name__ == '__main__':
-    recorder = GestureTracker()
-    recorder.run()
+    parser = argparse.ArgumentParser(description='Detect gestures from the webcam.')
+    parser.add_argument('--timings', action='store_true', help='show per-stage latency percentiles on screen')
+    parser.add_argument('--timings-file', help='.json or .csv file the per-stage percentiles are written to')
+    parser.add_argument('--roi', action='store_true', help='run inference on a crop around the tracked pose')
+    parser.add_argument('--processes', action='store_true',
+                        help='run the camera and the inference in their own processes, sharing frames through memory')
+    args = parser.parse_args()
+
+    timer = StageTimer(enabled=args.timings or bool(args.timings_file), overlay=args.timings,
+                       dump_path=args.timings_file)
+    recorder = GestureTracker(camera=None if args.processes else 0, timer=timer, use_roi=args.roi)
+    if args.processes:
+        recorder.run_pipeline()
+    else:
+        recorder.run()
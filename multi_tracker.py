@@ -0,0 +1,159 @@
+"""
+Track gestures on several cameras at once, sharing a bounded pool of inference workers.
+
+Run with e.g.:
+python multi_tracker.py 0 1 2 --workers 2
+"""
+
+import os
+
+# Each stream already runs on its own worker, so the BLAS pools NumPy starts with must not multiply
+# the threads. These only take effect before NumPy is first imported.
+for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(variable, '1')
+
+import argparse
+import contextlib
+import queue
+import threading
+
+import cv2
+
+from gesture_tracker import POSE_SETTINGS, GestureTracker
+from utils import config
+from utils.fps_tracker import FPSTracker
+
+READ_TIMEOUT = 1.0
+
+
+class MultiGestureTracker:
+    def __init__(self, sources: list, workers: int = 2, mode: str = 'dtw', opencv_threads: int = 1):
+        """
+        Initialize one gesture tracker per source, each with its own point history and detections.
+
+        Every stream is pinned to one worker, the streams being dealt round-robin over the workers. A worker runs
+        a MediaPipe graph per stream in video mode, so the pose is tracked from frame to frame instead of
+        detected anew. The streams of a worker take turns: a stream is queued again only once its frame has been
+        processed, so every stream gets its turn and no stream has more than one frame in flight.
+
+        :param sources: camera IDs or video paths
+        :param workers: number of inference workers, at most one per stream
+        :param mode: matching mode of every tracker, see GestureTracker
+        :param opencv_threads: number of threads each OpenCV call may use
+        """
+        cv2.setNumThreads(opencv_threads)
+
+        self.sources = list(sources)
+        self.trackers = [GestureTracker(camera=source, mode=mode) for source in self.sources]
+        self.fps_trackers = [FPSTracker(buffer_len=10) for _ in self.sources]
+        self.workers = max(1, min(workers, len(self.sources)))
+        self.ready = [queue.Queue() for _ in range(self.workers)]
+        self.images = [None] * len(self.sources)
+        self.images_lock = threading.Lock()
+        self.active = len(self.sources)
+        self.running = True
+
+        for index in range(len(self.sources)):
+            self.ready[index % self.workers].put(index)
+
+    def worker(self, worker: int, display: bool):
+        ready = self.ready[worker]
+        with contextlib.ExitStack() as stack:
+            # A graph that tracks the pose must only see the frames of one stream
+            graphs = {index: stack.enter_context(config.mp_pose.Pose(**POSE_SETTINGS))
+                      for index in range(worker, len(self.sources), self.workers)}
+
+            while self.running:
+                try:
+                    index = ready.get(timeout=READ_TIMEOUT)
+                except queue.Empty:
+                    continue
+
+                tracker = self.trackers[index]
+                ret, frame = tracker.capture.read(timeout=READ_TIMEOUT)
+                if not ret:
+                    if not tracker.capture.running:
+                        print(f'Stream {self.sources[index]} ended')
+                        self.stop_stream(index)
+                        continue
+
+                    # No new frame yet, give the other streams their turn
+                    ready.put(index)
+                    continue
+
+                detection_count = tracker.detection_count
+                image = tracker.process_frame(frame, graphs[index], display=display,
+                                              fps=self.fps_trackers[index].get())
+                if tracker.detection_count > detection_count:
+                    print(f'Stream {self.sources[index]}: {tracker.detected}')
+
+                if display:
+                    with self.images_lock:
+                        self.images[index] = image
+
+                ready.put(index)
+
+    def stop_stream(self, index: int):
+        self.trackers[index].capture.release()
+        with self.images_lock:
+            self.active -= 1
+            if not self.active:
+                self.running = False
+
+    def run(self, display: bool = True):
+        """
+        Process every stream until ESC is pressed or every stream has ended.
+
+        :param display: whether to show a window per stream
+        :return:
+        """
+        threads = [threading.Thread(target=self.worker, args=(worker, display), daemon=True)
+                   for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Stop if every worker has died, e.g. because the model could not be loaded
+            while self.running and any(thread.is_alive() for thread in threads):
+                if not display:
+                    threads[0].join(timeout=READ_TIMEOUT)
+                    continue
+
+                # Windows can only be updated from the main thread
+                with self.images_lock:
+                    images, self.images = self.images, [None] * len(self.sources)
+
+                for source, image in zip(self.sources, images):
+                    if image is not None:
+                        cv2.imshow(f'Gesture Tracker {source}', image)
+
+                if cv2.waitKey(1) == 27:  # ESC
+                    break
+        except KeyboardInterrupt:
+            pass
+
+        self.running = False
+        for thread in threads:
+            thread.join()
+
+        for tracker in self.trackers:
+            tracker.capture.release()
+            if tracker.dispatcher is not None:
+                tracker.dispatcher.close()
+
+        cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect gestures from several cameras at once.')
+    parser.add_argument('sources', nargs='+', help='camera IDs or video paths')
+    parser.add_argument('--workers', type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help='number of inference workers, the streams are dealt round-robin over them')
+    parser.add_argument('--mode', default='dtw', choices=('dtw', 'spring', 'compiled', 'dtw3d'))
+    parser.add_argument('--opencv-threads', type=int, default=1, help='threads each OpenCV call may use')
+    parser.add_argument('--headless', action='store_true', help='print detections without showing the streams')
+    args = parser.parse_args()
+
+    tracker = MultiGestureTracker([int(source) if source.isdigit() else source for source in args.sources],
+                                  workers=args.workers, mode=args.mode, opencv_threads=args.opencv_threads)
+    tracker.run(display=not args.headless)
@@ -1,11 +1,21 @@
+import argparse
 import json
 import os
 
 import cv2
 import numpy as np
 
-from utils.config import mp_hands, mp_drawing
+from utils import config
+from utils.capture import ThreadedCapture
+from utils.config import drawing_spec
 from utils.fps_tracker import FPSTracker
+from utils.frame_pipeline import FramePipeline
+from utils.landmarks import empty_landmarks, found_rows, to_landmark_list, write_landmarks
+from utils.overlay import REFRESH_INTERVAL, Overlay
+from utils.pose_index import PoseIndex, best_poses
+from utils.roi import RegionOfInterest
+from utils.stage_timer import StageTimer
+from utils.template_store import LIBRARY_DIR, TemplateLibrary, load_json
 
 NUM_LANDMARKS = 21
 INFO_TEXT = ('"S" to save the pose\n'
@@ -24,21 +34,36 @@ class PoseRecorder:
             model_complexity: int = 0,
             pose_leniency: float = 0.3,
             pose_threshold: float = 0.99,
-            save_dir: str = 'data/models/poses'
+            save_dir: str = 'data/models/poses',
+            use_index: bool = False,
+            library_dir: str = LIBRARY_DIR,
+            timer: StageTimer = None,
+            use_roi: bool = False
     ):
         """
         Initialize the recorder.
 
-        :param camera: camera ID to use
+        :param camera: camera ID to use, None to match poses without a camera, e.g. in benchmarks
         :param num_hands: number of hands to detect
         :param static_image_mode: whether each frame is a static image or a video
         :param min_detection_confidence: the minimum confidence for detection
         :param min_tracking_confidence: the minimum confidence for tracking
         :param pose_leniency: the leniency of the pose (0-1)
         :param pose_threshold: the threshold of the pose (0-1)
+        :param save_dir: directory the poses are saved to and loaded from
+        :param use_index: whether to match poses through a KD-tree index instead of a linear scan
+        :param library_dir: binary template library to use instead of save_dir, if it exists
+        :param timer: per-stage timer of the live loop, disabled if None
+        :param use_roi: whether to run inference on a crop around the previous frame's hands instead of the whole frame
         """
-        self.capture = cv2.VideoCapture(camera)
+        self.capture = ThreadedCapture(camera) if camera is not None else None
+        self.timer = timer or StageTimer()
+        self.roi = RegionOfInterest() if use_roi else None
+        self.overlay = Overlay()
+        for i, line in enumerate(INFO_TEXT.split('\n')):
+            self.overlay.text(f'info {i}', line, (10, 670 + i * 20), 0.6, colors=((255, 255, 255),), thicknesses=(1,))
         self.num_hands = num_hands
+        self.landmarks = empty_landmarks('hands', num_hands)
         self.static_image_mode = static_image_mode
         self.min_detection_confidence = min_detection_confidence
         self.min_tracking_confidence = min_tracking_confidence
@@ -47,12 +72,20 @@ class PoseRecorder:
         self.pose_threshold = pose_threshold
         self.save_dir = save_dir
         self.pose = ''
-        self.poses = self.load_poses(save_dir=save_dir)
+        self.library = TemplateLibrary(library_dir)
+        self.poses = self.load_poses(save_dir=save_dir, library=self.library)
+        self.saved_count = self.last_pose_number(save_dir=save_dir, library=self.library)
+        self.pose_names = list(self.poses.keys())
+        self.pose_matrix = self.build_pose_matrix(self.poses)
+        self.pose_index = PoseIndex(pose_leniency, pose_threshold) if use_index else None
+        if self.pose_index is not None:
+            self.pose_index.update(self.pose_matrix)
         self.detected = {num: None for num in range(num_hands)}
 
     def __del__(self):
         cv2.destroyAllWindows()
-        self.capture.release()
+        if self.capture is not None:
+            self.capture.release()
 
     def get_color(self, hand: int) -> tuple[int, int, int]:
         """
@@ -65,49 +98,51 @@ class PoseRecorder:
 
         return 0, 0, 255
 
-    def draw_landmarks(self, frame, results):
+    @property
+    def model_settings(self) -> dict:
+        """Keyword arguments of the mediapipe hands model"""
+        return {
+            'static_image_mode': self.static_image_mode,
+            'min_detection_confidence': self.min_detection_confidence,
+            'min_tracking_confidence': self.min_tracking_confidence,
+            'max_num_hands': self.num_hands,
+            'model_complexity': self.model_complexity
+        }
+
+    def draw_landmarks(self, frame, hand_landmarks: np.ndarray, mirror: bool = False):
         """
         Draw the landmarks on the frame.
 
         :param frame: frame to draw on
-        :param results: results from the mediapipe hands module
+        :param hand_landmarks: numpy array of shape (hands found, 21, 4) with the landmarks of every hand
+        :param mirror: whether the frame is mirrored
         :return:
         """
-        for index, hand_landmarks in enumerate(results.multi_hand_landmarks):
+        for index, landmarks in enumerate(hand_landmarks):
             color = self.get_color(index)
-            mp_drawing.draw_landmarks(
+            config.mp_drawing.draw_landmarks(
                 image=frame,
-                landmark_list=hand_landmarks,
-                connections=mp_hands.HAND_CONNECTIONS,
-                landmark_drawing_spec=mp_drawing.DrawingSpec(color=color, thickness=2, circle_radius=2),
-                connection_drawing_spec=mp_drawing.DrawingSpec(color=color, thickness=2, circle_radius=2)
+                landmark_list=to_landmark_list(landmarks, mirror=mirror, visibility=False),
+                connections=config.mp_hands.HAND_CONNECTIONS,
+                landmark_drawing_spec=drawing_spec(color),
+                connection_drawing_spec=drawing_spec(color)
             )
 
     def draw_info(self, image, fps: int):
-        cv2.putText(image, 'FPS:' + str(fps), (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                    1.0, (0, 0, 0), 4, cv2.LINE_AA)
-        cv2.putText(image, "FPS:" + str(fps), (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                    1.0, (255, 255, 255), 2, cv2.LINE_AA)
+        self.overlay.text('fps', 'FPS:' + str(fps), (10, 30), 1.0, interval=REFRESH_INTERVAL)
 
         index = 1
         for hand, pose in self.detected.items():
             if not pose:
+                self.overlay.text(f'hand {hand}', None, (10, 110 + hand * 30), 1.0)
                 continue
 
-            text = f'HAND {index} - POSE {pose}'
-            cv2.putText(image, text, (10, 110 + hand * 30), cv2.FONT_HERSHEY_SIMPLEX,
-                        1.0, (255, 255, 255), 4, cv2.LINE_AA)
-            cv2.putText(image, text, (10, 110 + hand * 30), cv2.FONT_HERSHEY_SIMPLEX,
-                        1.0, (0, 0, 0), 2, cv2.LINE_AA)
-
+            self.overlay.text(f'hand {hand}', f'HAND {index} - POSE {pose}', (10, 110 + hand * 30), 1.0,
+                              colors=((255, 255, 255), (0, 0, 0)))
             index += 1
 
-        # Split INFO_TEXT on newline characters
-        info_text = INFO_TEXT.split('\n')
-        for i, line in enumerate(info_text):
-            cv2.putText(image, line, (10, 670 + i * 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
-
-        return image
+        # INFO_TEXT never changes, so its layers are only rendered once in __init__
+        return self.overlay.draw(image)
 
     def save_pose(self, ratios: np.ndarray):
         """
@@ -115,37 +150,79 @@ class PoseRecorder:
         :param ratios: list of ratios
         :return:
         """
-        if not os.path.exists(self.save_dir):
-            os.makedirs(self.save_dir)
+        self.saved_count += 1
+        pose_name = f'{self.saved_count}'
+        if self.library.exists:
+            self.library.append_pose(pose_name, ratios)
+        else:
+            if not os.path.exists(self.save_dir):
+                os.makedirs(self.save_dir)
 
-        pose_name = f'{len(os.listdir(self.save_dir)) + 1}'
-        with open(f'{self.save_dir}/{pose_name}.json', 'w') as f:
-            json.dump(ratios.tolist(), f)
+            with open(f'{self.save_dir}/{pose_name}.json', 'w') as f:
+                json.dump(ratios.tolist(), f)
 
         self.poses[pose_name] = ratios
+        self.pose_names.append(pose_name)
+        self.pose_matrix = np.concatenate((self.pose_matrix, ratios[np.newaxis, :]), axis=0)
+        if self.pose_index is not None:
+            self.pose_index.update(self.pose_matrix)
 
     @staticmethod
-    def load_poses(save_dir: str):
+    def load_poses(save_dir: str, library: TemplateLibrary = None):
         """
-        Load all poses from the data/models/poses directory.
+        Load all poses from the template library if it exists, otherwise from the data/models/poses directory.
         :return:
         """
+        if library is not None and library.exists:
+            return library.poses()
+
         poses = {}
         if not os.path.exists(save_dir):
             return poses
 
         for file in os.listdir(save_dir):
-            with open(f'{save_dir}/{file}', 'r') as f:
-                poses[file[:-5]] = np.array(json.load(f))
+            if file.endswith('.json') and (ratios := load_json(f'{save_dir}/{file}')) is not None:
+                poses[file[:-5]] = np.array(ratios)
 
         return poses
 
+    @staticmethod
+    def last_pose_number(save_dir: str, library: TemplateLibrary = None) -> int:
+        """
+        Highest number a pose is named after, so that a new pose never reuses the name of an existing one.
+        Files load_poses skips, e.g. empty ones, and poses in the library count as well.
+
+        :return: the highest number, 0 if no pose is named after one
+        """
+        names = [entry['name'] for entry in library.entries('pose')] if library is not None else []
+        if os.path.exists(save_dir):
+            names += [file[:-5] for file in os.listdir(save_dir) if file.endswith('.json')]
+
+        return max((int(name) for name in names if name.isdigit()), default=0)
+
+    @staticmethod
+    def build_pose_matrix(poses: dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Stack the saved poses into one contiguous matrix so they can be scored together.
+
+        :param poses: saved poses keyed by name
+        :return: numpy array of shape (number of poses, NUM_LANDMARKS)
+        """
+        if not poses:
+            return np.empty((0, NUM_LANDMARKS))
+
+        return np.ascontiguousarray(np.stack(list(poses.values())), dtype=float)
+
     def clear_pose(self):
         """
         Clear the pose.
         :return:
         """
         self.poses.clear()
+        self.pose_names.clear()
+        self.pose_matrix = self.build_pose_matrix(self.poses)
+        if self.pose_index is not None:
+            self.pose_index.update(self.pose_matrix)
         for key in self.detected:
             self.detected[key] = None
 
@@ -154,49 +231,41 @@ class PoseRecorder:
         Check if the pose is within the leniency and threshold of the saved pose.
 
         :param ratios: list of ratios
-        :return: True if pose surpasses threshold, False otherwise
+        :return: name of the best matching pose, None if no pose surpasses threshold
         """
-        wrong_threshold = len(ratios) * (1 - self.pose_threshold)
-        scores = []
-        for name, pose in self.poses.items():
-            deviations = np.abs(ratios - pose)
-            wrong = np.sum(deviations > self.pose_leniency)
-            if wrong <= wrong_threshold:
-                scores.append((name, np.mean(deviations)))
+        return self.check_poses(ratios[np.newaxis, :])[0]
 
-        if scores:
-            scores.sort(key=lambda x: x[1])
-            return scores[0][0]
+    def check_poses(self, ratios: np.ndarray) -> list:
+        """
+        Score every hand against every saved pose in a single batched operation.
 
-        return None
+        :param ratios: numpy array of shape (number of hands, NUM_LANDMARKS)
+        :return: name of the best matching pose for each hand, None where no pose surpasses threshold
+        """
+        if self.pose_index is not None:
+            best = self.pose_index.query(ratios, self.pose_matrix)
+        else:
+            best = best_poses(ratios, self.pose_matrix, self.pose_leniency, self.pose_threshold)
+
+        return [self.pose_names[pose] if pose >= 0 else None for pose in best]
 
     @staticmethod
-    def calculate_ratios(hand_landmarks) -> np.ndarray:
+    def calculate_ratios(hand_landmarks: np.ndarray) -> np.ndarray:
         """
         Similar to calculate_ratios_2, but instead of ratios,
         we calculate distances from landmark 0, normalized to 0-1.
         This works pretty well with pose_leniency 0.3 and threshold 0.99.
         The advantage of this method is that it allows for any rotation of the hand, in any plane.
-        Creates an array of size 21.
+        Creates an array of size 21 for every hand.
 
-        :param hand_landmarks: hand landmarks
-        :return: numpy array of distances from landmark 0, normalized to 0-1
+        :param hand_landmarks: numpy array of shape (..., 21, 4) with the landmarks of one or more hands
+        :return: numpy array of shape (..., 21) of distances from landmark 0, normalized to 0-1
         """
-        x = []
-        y = []
-        for landmark in hand_landmarks.landmark:
-            x.append(landmark.x)
-            y.append(landmark.y)
-
-        x = np.array(x)
-        y = np.array(y)
-
-        zero_x, zero_y = x[0], y[0]
-        x -= zero_x
-        y -= zero_y
+        offsets = hand_landmarks[..., :2].astype(float)
+        offsets -= offsets[..., :1, :]
 
-        distances = np.square(x) + np.square(y)
-        distances /= np.max(distances)
+        distances = np.square(offsets[..., 0]) + np.square(offsets[..., 1])
+        distances /= np.max(distances, axis=-1, keepdims=True)
 
         return distances
 
@@ -206,7 +275,7 @@ class PoseRecorder:
 
         :param key: key pressed
         :param ratios: list of ratios
-        :param hand_landmarks: hand landmarks
+        :param hand_landmarks: numpy array of shape (21, 4) with the landmarks of the hand to save
         :return: True if the program should exit, False otherwise
         """
         if key == 27:  # ESC
@@ -228,44 +297,126 @@ class PoseRecorder:
 
         :return:
         """
-        with mp_hands.Hands(
-                static_image_mode=self.static_image_mode,
-                min_detection_confidence=self.min_detection_confidence,
-                min_tracking_confidence=self.min_tracking_confidence,
-                max_num_hands=self.num_hands,
-                model_complexity=self.model_complexity
-        ) as hands:
-            fps_tracker = FPSTracker()
+        with config.mp_hands.Hands(**self.model_settings) as hands:
+            fps_tracker = FPSTracker(buffer_len=10)
+            timer = self.timer
             while True:
+                timer.start()
                 _, frame = self.capture.read()
+                timer.lap('capture')
 
                 # To improve performance, mark the image as not writeable to pass by reference
                 frame.flags.writeable = False
-                results = hands.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                image = cv2.cvtColor(self.roi.crop(frame) if self.roi is not None else frame, cv2.COLOR_BGR2RGB)
+                timer.lap('convert')
+                results = hands.process(image)
                 frame.flags.writeable = True
+                timer.lap('inference')
+
+                write_landmarks('hands', results, self.landmarks)
+                if self.roi is not None:
+                    # calculate_ratios compares distances in full-frame coordinates, like the saved poses
+                    self.roi.to_frame(self.landmarks)
+                    self.roi.update(self.landmarks)
+                hands_found = found_rows(self.landmarks)
+                timer.lap('landmarks')
 
                 hand_landmarks = None
                 ratios = None
-                if results.multi_hand_landmarks is not None:  # type: ignore
-                    self.draw_landmarks(frame=frame, results=results)  # type: ignore
-                    if self.poses:
-                        for index in range(self.num_hands):
-                            try:
-                                hand_landmarks = results.multi_hand_landmarks[index]  # type: ignore
-                            except IndexError:
-                                self.detected[index] = None
-                                continue
+                if len(hands_found):
+                    self.draw_landmarks(frame=frame, hand_landmarks=hands_found)
+                    timer.lap('drawing')
+                    ratios, hand_landmarks = self.match_hands(hands_found)
 
-                            ratios = self.calculate_ratios(hand_landmarks=hand_landmarks)
-                            self.detected[index] = self.check_pose(ratios=ratios)
+                image = timer.draw(self.draw_info(image=cv2.flip(frame, 1), fps=fps_tracker.get()))
+                timer.lap('drawing')
+                cv2.imshow('Test Hand', image)
 
-                cv2.imshow('Test Hand', self.draw_info(image=cv2.flip(frame, 1), fps=fps_tracker.get()))
+                key = cv2.waitKey(1)
+                timer.lap('display')
+                if self.handle_key(key=key, ratios=ratios, hand_landmarks=hand_landmarks):
+                    break
+
+                timer.end_frame()
+
+            if self.timer.dump_path:
+                self.timer.dump()
+
+    def match_hands(self, hand_landmarks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Match every hand found in the frame against the saved poses.
+
+        :param hand_landmarks: numpy array of shape (hands found, 21, 4) with the landmarks of every hand
+        :return: tuple of (ratios, landmarks) of the last hand, to save when "S" is pressed,
+            the ratios are None without saved poses
+        """
+        hand_landmarks = hand_landmarks[:self.num_hands]
+        ratios = None
+        if self.pose_names:
+            all_ratios = self.calculate_ratios(hand_landmarks=hand_landmarks)
+            ratios = all_ratios[-1]
+            self.timer.lap('landmarks')
+
+            matches = self.check_poses(ratios=all_ratios)
+            for index in range(self.num_hands):
+                self.detected[index] = matches[index] if index < len(hand_landmarks) else None
+            self.timer.lap('matching')
+
+        return ratios, hand_landmarks[-1]
+
+    def record_pipeline(self, source=0):
+        """
+        Record poses like record, with the camera and the hand inference in processes of their own.
+
+        :param source: camera ID or video path
+        :return:
+        """
+        fps_tracker = FPSTracker(buffer_len=10)
+        timer = self.timer
+        with FramePipeline(source, 'hands', self.model_settings, num_hands=self.num_hands,
+                           use_roi=self.roi is not None) as pipeline:
+            for frame, landmarks in pipeline:
+                timer.start()
+                # The shared frame is read-only, so the landmarks are drawn mirrored onto the mirrored copy
+                image = cv2.flip(frame, 1)
+                hands_found = found_rows(landmarks)
+                timer.lap('landmarks')
+
+                hand_landmarks = None
+                ratios = None
+                if len(hands_found):
+                    self.draw_landmarks(frame=image, hand_landmarks=hands_found, mirror=True)
+                    timer.lap('drawing')
+                    ratios, hand_landmarks = self.match_hands(hands_found)
+
+                image = timer.draw(self.draw_info(image=image, fps=fps_tracker.get()))
+                timer.lap('drawing')
+                cv2.imshow('Test Hand', image)
 
                 key = cv2.waitKey(1)
+                timer.lap('display')
                 if self.handle_key(key=key, ratios=ratios, hand_landmarks=hand_landmarks):
                     break
 
+                timer.end_frame()
+
+        if self.timer.dump_path:
+            self.timer.dump()
+
 
 if __name__ == '__main__':
-    recorder = PoseRecorder()
-    recorder.record()
+    parser = argparse.ArgumentParser(description='Record and detect hand poses from the webcam.')
+    parser.add_argument('--timings', action='store_true', help='show per-stage latency percentiles on screen')
+    parser.add_argument('--timings-file', help='.json or .csv file the per-stage percentiles are written to')
+    parser.add_argument('--roi', action='store_true', help='run inference on a crop around the tracked hands')
+    parser.add_argument('--processes', action='store_true',
+                        help='run the camera and the inference in their own processes, sharing frames through memory')
+    args = parser.parse_args()
+
+    timer = StageTimer(enabled=args.timings or bool(args.timings_file), overlay=args.timings,
+                       dump_path=args.timings_file)
+    recorder = PoseRecorder(camera=None if args.processes else 0, timer=timer, use_roi=args.roi)
+    if args.processes:
+        recorder.record_pipeline()
+    else:
+        recorder.record()
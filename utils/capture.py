@@ -0,0 +1,82 @@
+import threading
+
+import cv2
+
+
+class ThreadedCapture:
+    def __init__(self, source=0):
+        """
+        Read frames from a video source on a background thread.
+
+        Only the newest frame is kept: a frame that is replaced before it was read is dropped and counted,
+        so the consumer never works on a stale frame.
+
+        The source is opened on the background thread as well, since opening a camera can take as long as loading
+        the model, and both can happen at the same time. Frames are only decoded once the first one is read,
+        so that decoding frames nobody reads does not slow down the rest of the startup.
+
+        :param source: camera ID or video path, as accepted by cv2.VideoCapture
+        """
+        self.source = source
+        self.capture = None
+        self.opened = threading.Event()
+        self.requested = threading.Event()
+        self.condition = threading.Condition()
+        self.ret = False
+        self.frame = None
+        self.sequence = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.running = True
+
+        self.thread = threading.Thread(target=self._reader, daemon=True)
+        self.thread.start()
+
+    def _reader(self):
+        self.capture = cv2.VideoCapture(self.source)
+        self.opened.set()
+        self.requested.wait()
+
+        while self.running:
+            ret, frame = self.capture.read()
+
+            with self.condition:
+                if self.sequence > self.consumed:
+                    self.dropped += 1
+
+                self.ret, self.frame = ret, frame
+                self.sequence += 1
+                if not ret:
+                    self.running = False
+
+                self.condition.notify_all()
+
+        self.capture.release()
+
+    def read(self, timeout: float = None):
+        """
+        Wait for a frame that has not been read yet and return it.
+
+        :param timeout: maximum number of seconds to wait, None to wait forever
+        :return: tuple of (success, frame) like cv2.VideoCapture.read
+        """
+        self.requested.set()
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > self.consumed or not self.running, timeout)
+            if self.sequence == self.consumed:
+                return False, None
+
+            self.consumed = self.sequence
+            return self.ret, self.frame
+
+    def isOpened(self) -> bool:
+        """Whether the source could be opened, waiting until the background thread has tried"""
+        self.opened.wait()
+        return self.capture.isOpened()
+
+    def release(self):
+        """Stop the background thread, which releases the source once its current read returns"""
+        self.running = False
+        self.requested.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
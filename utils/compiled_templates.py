@@ -0,0 +1,48 @@
+import numpy as np
+
+from utils.tracker_2d import resample_batch
+
+COMPILED_LENGTH = 16
+
+
+class CompiledTemplates:
+    def __init__(self, gestures: list[dict], landmark_ids: list[int], length: int = COMPILED_LENGTH):
+        """
+        Stack every gesture into one (gestures, landmarks, length, 2) tensor so they can be scored together.
+
+        Each landmark trajectory is resampled to `length` points evenly spaced along its path, which removes
+        the differences in point count left by simplify_gesture. Landmarks a gesture does not use are masked out.
+
+        :param gestures: gestures loaded by GestureTracker.load_gestures
+        :param landmark_ids: landmark ids in the row order of the live window
+        :param length: number of points per trajectory
+        """
+        self.names = [gesture['name'] for gesture in gestures]
+        self.landmark_ids = list(landmark_ids)
+        self.length = length
+        self.templates = np.zeros((len(gestures), len(self.landmark_ids), length, 2))
+        self.mask = np.zeros((len(gestures), len(self.landmark_ids)), dtype=bool)
+
+        for index, gesture in enumerate(gestures):
+            for landmark_id, points in gesture['points'].items():
+                row = self.landmark_ids.index(int(landmark_id))
+                points = np.asarray(points, dtype=float)[np.newaxis, :, :]
+                self.templates[index, row] = resample_batch(points, length)[0]
+                self.mask[index, row] = True
+
+        self.landmark_counts = self.mask.sum(axis=1)
+
+    def score(self, window: np.ndarray) -> np.ndarray:
+        """
+        Score every gesture against a resampled live window.
+
+        :param window: numpy array of shape (landmarks, length, 2), resampled like the templates
+        :return: mean point distance over the landmarks each gesture uses, one score per gesture
+        """
+        distances = np.sqrt(np.sum((self.templates - window) ** 2, axis=3)).mean(axis=2)
+        return np.sum(distances * self.mask, axis=1) / self.landmark_counts
+
+    def reversed_scores(self) -> np.ndarray:
+        """Score of every gesture against itself performed backwards, the closest motion it must not match"""
+        distances = np.sqrt(np.sum((self.templates - self.templates[:, :, ::-1]) ** 2, axis=3)).mean(axis=2)
+        return np.sum(distances * self.mask, axis=1) / self.landmark_counts
@@ -1,21 +1,41 @@
-import mediapipe as mp
-
-mp_hands = mp.solutions.hands
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
-draw_style = mp.solutions.drawing_styles.get_default_pose_landmarks_style()
-
-FOCUS_POINTS = {
-    mp_pose.PoseLandmark.LEFT_HIP,
-    mp_pose.PoseLandmark.RIGHT_HIP,
-    mp_pose.PoseLandmark.LEFT_KNEE,
-    mp_pose.PoseLandmark.RIGHT_KNEE,
-    mp_pose.PoseLandmark.LEFT_ANKLE,
-    mp_pose.PoseLandmark.RIGHT_ANKLE,
-    mp_pose.PoseLandmark.LEFT_SHOULDER,
-    mp_pose.PoseLandmark.RIGHT_SHOULDER,
-    mp_pose.PoseLandmark.LEFT_ELBOW,
-    mp_pose.PoseLandmark.RIGHT_ELBOW,
-    mp_pose.PoseLandmark.LEFT_WRIST,
-    mp_pose.PoseLandmark.RIGHT_WRIST
-}
+"""
+MediaPipe solution handles, loaded on first use.
+
+Importing mediapipe takes most of a second, so mp_hands, mp_pose, mp_drawing, draw_style and FOCUS_POINTS
+are only resolved when first accessed, e.g. config.mp_pose. Code that only needs landmark ids, like the
+matching and replay of recorded landmarks, never loads it.
+"""
+
+from functools import lru_cache
+
+# Values of mediapipe's PoseLandmark for the shoulders, elbows, wrists, hips, knees and ankles
+FOCUS_LANDMARK_IDS = [11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28]
+
+
+@lru_cache(maxsize=None)
+def load_mediapipe() -> dict:
+    """Import mediapipe and resolve every handle, so later lookups find them directly without __getattr__"""
+    import mediapipe as mp
+
+    values = {
+        'mp_hands': mp.solutions.hands,
+        'mp_pose': mp.solutions.pose,
+        'mp_drawing': mp.solutions.drawing_utils,
+        'draw_style': mp.solutions.drawing_styles.get_default_pose_landmarks_style(),
+        'FOCUS_POINTS': {mp.solutions.pose.PoseLandmark(landmark_id) for landmark_id in FOCUS_LANDMARK_IDS}
+    }
+    globals().update(values)
+    return values
+
+
+def __getattr__(name: str):
+    if name not in ('mp_hands', 'mp_pose', 'mp_drawing', 'draw_style', 'FOCUS_POINTS'):
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    return load_mediapipe()[name]
+
+
+@lru_cache(maxsize=None)
+def drawing_spec(color: tuple[int, int, int]):
+    """Shared drawing spec of a color, so drawing landmarks does not build new specs every frame"""
+    return load_mediapipe()['mp_drawing'].DrawingSpec(color=color, thickness=2, circle_radius=2)
@@ -0,0 +1,128 @@
+import json
+import math
+import queue
+import threading
+import time
+
+
+def load_bindings(path: str = 'data/bindings.json') -> dict[str, list[dict]]:
+    """Load the gesture to action bindings from a JSON file"""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class ActionDispatcher:
+    def __init__(self, bindings: dict[str, list[dict]], max_pending: int = 4):
+        """
+        Turn detected gestures into mouse and keyboard actions on a worker thread.
+
+        dispatch() never blocks: a gesture that is already queued or running is coalesced,
+        and a gesture arriving while the queue is full is dropped. A gesture whose actions fail is reported
+        and counted, and the worker goes on with the next one.
+
+        :param bindings: list of action steps for each gesture name
+        :param max_pending: maximum number of gestures waiting to be performed
+        """
+        self.bindings = bindings
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def dispatch(self, gesture: str) -> bool:
+        """
+        Queue the actions bound to a gesture without waiting for them.
+
+        :param gesture: name of the detected gesture
+        :return: True if the gesture was queued, False if it was unbound, coalesced or dropped
+        """
+        if gesture not in self.bindings:
+            return False
+
+        with self.lock:
+            if gesture in self.pending:
+                self.coalesced += 1
+                return False
+
+            try:
+                self.queue.put_nowait(gesture)
+            except queue.Full:
+                self.dropped += 1
+                return False
+
+            self.pending.add(gesture)
+
+        return True
+
+    def close(self, timeout: float = 1.0):
+        """Stop the worker once the queued gestures have been performed"""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+
+        self.thread.join(timeout=timeout)
+
+    def _worker(self):
+        # Controllers are created here since pynput needs a display server and is only used by this thread
+        try:
+            from pynput.keyboard import Controller as KeyboardController
+            from pynput.mouse import Controller
+
+            mouse = Controller()
+            keyboard = KeyboardController()
+        except Exception as error:
+            # Gestures are still taken off the queue, so that dispatch keeps accepting them
+            print(f'Actions disabled, pynput failed: {error!r}')
+            mouse = keyboard = None
+
+        while (gesture := self.queue.get()) is not None:
+            try:
+                if mouse is not None:
+                    for step in self.bindings[gesture]:
+                        self.perform(step, mouse, keyboard)
+            except Exception as error:
+                self.failed += 1
+                print(f'Actions of {gesture} failed: {error!r}')
+            finally:
+                with self.lock:
+                    self.pending.discard(gesture)
+
+    @staticmethod
+    def perform(step: dict, mouse, keyboard):
+        """
+        Perform a single action step.
+
+        :param step: the step, e.g. {"action": "tap", "key": "enter", "hold": 0.04}
+        :param mouse: pynput mouse controller
+        :param keyboard: pynput keyboard controller
+        :return:
+        """
+        action = step['action']
+        if action == 'position':
+            mouse.position = (step['x'], step['y'])
+
+        elif action == 'sleep':
+            time.sleep(step['seconds'])
+
+        elif action == 'drag':
+            # Move the mouse with a step size decreasing from start to stop
+            for i in range(step['start'], step['stop'], -1):
+                mouse.move(math.floor(i * step['dx']), math.floor(i * step['dy']))
+                time.sleep(step['delay'])
+
+        elif action == 'tap':
+            from pynput.keyboard import Key
+
+            key = step['key'] if len(step['key']) == 1 else getattr(Key, step['key'])
+            keyboard.press(key)
+            time.sleep(step['hold'])
+            keyboard.release(key)
+
+        else:
+            raise ValueError(f'Unknown action: {action}')
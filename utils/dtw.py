@@ -0,0 +1,108 @@
+"""
+Lower bounds and early abandoning for DTW with euclidean point distances.
+Every bound here is at most the exact DTW distance, so anything they prune could not have matched.
+"""
+
+from itertools import accumulate
+
+import numpy as np
+
+# Template length from which a row of the cost matrix is cheaper to accumulate with numpy than cell by cell,
+# from timing both on random points: simplified windows and templates usually have fewer than 10 points
+VECTORIZED_MIN_LENGTH = 32
+
+
+def envelope(points: np.ndarray):
+    """Bounding box of the points, as (lower, upper) corners"""
+    return points.min(axis=0), points.max(axis=0)
+
+
+def lb_kim(query: np.ndarray, template: np.ndarray) -> float:
+    """Every warping path matches the first points together and the last points together"""
+    bound = np.linalg.norm(query[0] - template[0])
+    if len(query) > 1 or len(template) > 1:
+        bound += np.linalg.norm(query[-1] - template[-1])
+
+    return bound
+
+
+def lb_kim_batch(query_ends: np.ndarray, query_lengths: np.ndarray, template_ends: np.ndarray,
+                 template_lengths: np.ndarray) -> np.ndarray:
+    """
+    lb_kim of many queries and templates at once.
+
+    :param query_ends: numpy array of shape (..., 2, dims) with the first and last point of each query
+    :param query_lengths: number of points of each query, of shape (...)
+    :param template_ends: first and last point of each template, broadcastable against query_ends
+    :param template_lengths: number of points of each template, broadcastable against query_lengths
+    :return: the bound of each pair, of shape (...)
+    """
+    distances = np.linalg.norm(query_ends - template_ends, axis=-1)
+    return distances[..., 0] + np.where((query_lengths > 1) | (template_lengths > 1), distances[..., 1], 0)
+
+
+def lb_keogh(query: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> float:
+    """Every query point is matched at least once, so it costs at least its distance to the template's envelope"""
+    outside = query - np.minimum(np.maximum(query, lower), upper)
+    return float(np.sqrt(np.einsum('ij,ij->i', outside, outside)).sum())
+
+
+def dtw_early_abandon(query: np.ndarray, template: np.ndarray, cutoff: float) -> float:
+    """
+    Exact DTW distance, abandoned as soon as it is certain to reach the cutoff.
+
+    :param query: numpy array of shape (n, dims)
+    :param template: numpy array of shape (m, dims)
+    :param cutoff: distance at which the comparison is no longer interesting
+    :return: the DTW distance, or inf if it was abandoned
+    """
+    costs = np.sqrt(np.sum((query[:, np.newaxis, :] - template[np.newaxis, :, :]) ** 2, axis=2))
+    if len(template) < VECTORIZED_MIN_LENGTH:
+        return dtw_rows(costs.tolist(), cutoff)
+
+    return dtw_rows_vectorized(costs, cutoff)
+
+
+def dtw_rows(costs: list[list[float]], cutoff: float) -> float:
+    """Accumulate the cost matrix one cell at a time, see dtw_early_abandon"""
+    previous = list(accumulate(costs[0]))
+    for row in costs[1:]:
+        # Costs are never negative, so the cheapest cell of a row bounds the final distance
+        if min(previous) >= cutoff:
+            return np.inf
+
+        left = previous[0] + row[0]
+        current = [left]
+        for j in range(1, len(row)):
+            best = previous[j - 1]
+            if previous[j] < best:
+                best = previous[j]
+            if left < best:
+                best = left
+            left = row[j] + best
+            current.append(left)
+
+        previous = current
+
+    return previous[-1] if min(previous) < cutoff else np.inf
+
+
+def dtw_rows_vectorized(costs: np.ndarray, cutoff: float) -> float:
+    """Accumulate the cost matrix one row at a time with numpy, see dtw_early_abandon"""
+    # Within a row, the cell j is min over k <= j of (the step into k from the previous row + costs k+1..j),
+    # which is the running sum of the row plus the running minimum of the steps minus that sum
+    totals = np.cumsum(costs, axis=1)
+    offsets = costs - totals
+    current = totals[0]
+    steps = np.empty(costs.shape[1])
+    for i in range(1, len(costs)):
+        if current.min() >= cutoff:
+            return np.inf
+
+        steps[0] = current[0]
+        np.minimum(current[:-1], current[1:], out=steps[1:])
+        steps += offsets[i]
+        np.minimum.accumulate(steps, out=steps)
+        current = steps + totals[i]
+
+    return float(current[-1]) if current.min() < cutoff else np.inf
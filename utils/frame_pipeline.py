@@ -0,0 +1,193 @@
+"""
+Capture, inference and display in separate processes, so that none of them waits on the GIL of another.
+
+The capture process decodes camera frames straight into a SharedRing, the inference process runs MediaPipe
+on the newest frame and publishes the landmarks into a second SharedRing, tagged with the frame's sequence.
+The display process, the one that creates the FramePipeline, iterates over the landmarks together with the
+frame they were found in, both as views of the shared memory. Only the bookkeeping of the rings crosses
+process boundaries, frames and landmarks are never pickled.
+"""
+
+import multiprocessing
+import queue
+import signal
+import time
+
+import cv2
+import numpy as np
+
+from utils import config
+from utils.landmarks import landmark_shape, write_landmarks
+from utils.roi import ROI_REFRESH_INTERVAL, RegionOfInterest
+from utils.shared_ring import SharedRing
+
+FRAME_SIZE = (1280, 720)
+FRAME_SLOTS = 5
+LANDMARK_SLOTS = 4
+READ_TIMEOUT = 0.5
+JOIN_TIMEOUT = 2.0
+
+# Readers of the frame ring. The inference process holds the frame of its newest landmarks as the pending
+# reader, so that the capture process cannot reuse its slot before the display process has taken it over.
+INFERENCE_READER = 0
+PENDING_READER = 1
+DISPLAY_READER = 2
+
+
+def capture_frames(source, frames: SharedRing, stop):
+    """
+    Read frames from the source into the frame ring until stopped or the source ends.
+
+    A camera delivers frames at its own rate, a video file is decoded as fast as possible. Frames of a video file
+    are therefore published at the frame rate of the video, otherwise inference would only see a few of them.
+    """
+    # Ctrl+C reaches every process of the terminal, but only the display process decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    capture = cv2.VideoCapture(source)
+    height, width = frames.shape[:2]
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    # Cameras and streams have no frame count
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    frame_interval = 1 / fps if fps > 0 and capture.get(cv2.CAP_PROP_FRAME_COUNT) > 0 else 0
+    next_frame = time.perf_counter()
+
+    while not stop.is_set():
+        if frame_interval:
+            # Waiting on the stop event returns as soon as the pipeline is closed
+            if stop.wait(max(next_frame - time.perf_counter(), 0)):
+                break
+            # A frame that is late does not make the next ones come faster
+            next_frame = max(next_frame, time.perf_counter()) + frame_interval
+
+        slot, view = frames.claim()
+        # Frames of the right size are decoded straight into the slot
+        ret, frame = capture.read(view)
+        if not ret:
+            break
+
+        if frame is not view:
+            cv2.resize(frame, (width, height), dst=view, interpolation=cv2.INTER_AREA)
+
+        frames.publish(slot)
+
+    capture.release()
+    frames.close()
+
+
+def infer_landmarks(kind: str, settings: dict, frames: SharedRing, landmarks: SharedRing, stop, errors,
+                    use_roi: bool = False):
+    """Run MediaPipe on the newest frame and publish its landmarks, tagged with the frame's sequence"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        model = config.mp_pose.Pose(**settings) if kind == 'pose' else config.mp_hands.Hands(**settings)
+    except Exception as error:
+        # e.g. the model could not be downloaded, the display process reports it once the pipeline ends
+        errors.put(repr(error))
+        landmarks.close()
+        return
+
+    # A single pose is only searched for in the whole frame once it is lost, see RegionOfInterest
+    roi = RegionOfInterest(refresh_interval=None if kind == 'pose' else ROI_REFRESH_INTERVAL) if use_roi else None
+    sequence = 0
+    with model:
+        while not stop.is_set():
+            sequence, _, frame = frames.acquire(INFERENCE_READER, after=sequence, timeout=READ_TIMEOUT)
+            if frame is None:
+                if frames.closed:
+                    break
+                continue
+
+            image = cv2.cvtColor(roi.crop(frame) if roi is not None else frame, cv2.COLOR_BGR2RGB)
+            results = model.process(image)
+            frames.acquire_sequence(PENDING_READER, sequence)
+            frames.release(INFERENCE_READER)
+
+            slot, output = landmarks.claim()
+            write_landmarks(kind, results, output)
+            if roi is not None:
+                # The world landmarks of a pose do not depend on the crop
+                image_landmarks = output[:1] if kind == 'pose' else output
+                roi.to_frame(image_landmarks)
+                roi.update(image_landmarks)
+            landmarks.publish(slot, tag=sequence)
+
+    landmarks.close()
+
+
+class FramePipeline:
+    def __init__(self, source=0, kind: str = 'pose', settings: dict = None, num_hands: int = 2,
+                 frame_size: tuple[int, int] = FRAME_SIZE, use_roi: bool = False):
+        """
+        Capture and inference processes connected to this one through shared memory.
+
+        Iterating over the pipeline yields (frame, landmarks) views that stay valid until the next iteration.
+        Leaving the with block, e.g. when ESC is pressed, stops both processes and frees the shared memory.
+
+        :param source: camera ID or video path, as accepted by cv2.VideoCapture
+        :param kind: 'pose' to run mediapipe pose, 'hands' to run mediapipe hands, see landmark_shape
+        :param settings: keyword arguments of the mediapipe model
+        :param num_hands: maximum number of hands the landmark arrays have room for
+        :param frame_size: (width, height) frames are captured at, resized to it if the camera does not support it
+        :param use_roi: whether to run inference on a crop around the previous frame's landmarks
+        """
+        width, height = frame_size
+        self.kind = kind
+        self.frames = SharedRing((height, width, 3), np.uint8, slots=FRAME_SLOTS, readers=3)
+        self.landmarks = SharedRing(landmark_shape(kind, num_hands), np.float32, slots=LANDMARK_SLOTS, readers=1)
+        self.stop = multiprocessing.Event()
+        self.errors = multiprocessing.Queue()
+        self.processes = [
+            multiprocessing.Process(target=capture_frames, args=(source, self.frames, self.stop), daemon=True),
+            multiprocessing.Process(target=infer_landmarks, daemon=True, args=(
+                kind, settings or {}, self.frames, self.landmarks, self.stop, self.errors, use_roi))
+        ]
+        self.skipped = 0
+
+    def __enter__(self):
+        for process in self.processes:
+            process.start()
+
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __iter__(self):
+        sequence = 0
+        while not self.stop.is_set():
+            sequence, frame_sequence, landmarks = self.landmarks.acquire(0, after=sequence, timeout=READ_TIMEOUT)
+            if landmarks is None:
+                if self.landmarks.closed:
+                    break
+                continue
+
+            _, _, frame = self.frames.acquire_sequence(DISPLAY_READER, frame_sequence)
+            if frame is None:
+                # Newer landmarks were published meanwhile and the slot of this frame was reused
+                self.skipped += 1
+                continue
+
+            yield frame, landmarks
+
+    def close(self):
+        """Stop both processes, waking them if they wait on a ring, then free the shared memory"""
+        self.stop.set()
+        self.frames.close()
+        self.landmarks.close()
+
+        for process in self.processes:
+            process.join(timeout=JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+        # The processes have flushed their queue once joined
+        try:
+            print(f'Inference failed: {self.errors.get_nowait()}')
+        except queue.Empty:
+            pass
+
+        self.frames.dispose()
+        self.landmarks.dispose()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_DIR = 'data/cache/landmarks'
+MAX_CACHE_BYTES = 1024 ** 3
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash the content of a file without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class LandmarkCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        """
+        On-disk cache of the landmarks extracted from videos.
+
+        Entries are .npy files named after the video content and the model settings, so a changed video
+        or model never reuses stale landmarks. Once the cache grows past max_bytes, the least recently
+        used entries are removed.
+
+        :param cache_dir: directory to store the entries in
+        :param max_bytes: maximum total size of the entries
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(path: str, **settings) -> str:
+        """
+        Key of a video's landmarks.
+
+        :param path: path of the video
+        :param settings: model settings the landmarks were extracted with
+        :return: hex digest of the video content and the settings
+        """
+        digest = hashlib.sha256(file_digest(path).encode())
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.npy')
+
+    def load(self, key: str):
+        """
+        Memory-map the landmarks stored under the key.
+
+        :param key: key from LandmarkCache.key
+        :return: read-only numpy array, None if the key is not cached
+        """
+        try:
+            landmarks = np.load(self.path(key), mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # The modification time doubles as the last use for eviction
+        os.utime(self.path(key))
+        return landmarks
+
+    def save(self, key: str, landmarks: np.ndarray):
+        """
+        Store landmarks under the key, then evict the least recently used entries if the cache is too big.
+
+        :param key: key from LandmarkCache.key
+        :param landmarks: numpy array to store
+        :return:
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Write to a temporary file first so other processes never map a partial entry
+        temporary = self.path(key) + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.save(f, landmarks)
+        os.replace(temporary, self.path(key))
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith('.npy'):
+                stat = os.stat(os.path.join(self.cache_dir, file))
+                entries.append((stat.st_mtime, stat.st_size, file))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            os.remove(os.path.join(self.cache_dir, file))
+            total -= size
@@ -0,0 +1,79 @@
+"""
+MediaPipe results as NumPy landmark arrays.
+
+The landmarks of every frame are copied out of the protobuf results once, with write_landmarks, into a float32
+array preallocated with landmark_shape: x, y, z and visibility of every landmark, NaN where nothing was found.
+Matching, recording, the region of interest and drawing all read from that array, so no other code walks
+the protobuf landmarks one attribute at a time.
+"""
+
+import numpy as np
+
+NUM_POSE_LANDMARKS = 33
+NUM_HAND_LANDMARKS = 21
+
+
+def landmark_shape(kind: str, num_hands: int = 2) -> tuple:
+    """
+    Shape of the landmark array of a frame.
+
+    :param kind: 'pose' for (2, 33, 4) image and world landmarks, 'hands' for (hands, 21, 4) image landmarks
+    :param num_hands: maximum number of hands
+    :return: the shape, with x, y, z and visibility for every landmark
+    """
+    if kind == 'pose':
+        return 2, NUM_POSE_LANDMARKS, 4
+
+    return num_hands, NUM_HAND_LANDMARKS, 4
+
+
+def empty_landmarks(kind: str, num_hands: int = 2) -> np.ndarray:
+    """Allocate the landmark array write_landmarks fills every frame"""
+    return np.full(landmark_shape(kind, num_hands), np.nan, dtype=np.float32)
+
+
+def write_landmarks(kind: str, results, output: np.ndarray):
+    """
+    Copy the landmarks of MediaPipe results into a landmark array in one pass, NaN where nothing was found.
+
+    :param kind: 'pose' or 'hands', see landmark_shape
+    :param results: results of mediapipe pose or hands
+    :param output: landmark array to fill, e.g. from empty_landmarks or a shared memory slot
+    :return:
+    """
+    output[:] = np.nan
+    if kind == 'pose':
+        landmark_lists = [results.pose_landmarks, results.pose_world_landmarks]
+    else:
+        landmark_lists = (results.multi_hand_landmarks or [])[:len(output)]
+
+    for row, landmark_list in enumerate(landmark_lists):
+        if landmark_list is not None:
+            output[row] = [(landmark.x, landmark.y, landmark.z, landmark.visibility)
+                           for landmark in landmark_list.landmark]
+
+
+def found_rows(landmarks: np.ndarray) -> np.ndarray:
+    """Landmarks of the hands or poses that were found, leaving out the NaN rows"""
+    return landmarks[~np.isnan(landmarks[:, 0, 0])]
+
+
+def to_landmark_list(landmarks: np.ndarray, mirror: bool = False, visibility: bool = True):
+    """
+    Rebuild the landmark list mp_drawing draws from a (landmarks, 4) array.
+
+    :param landmarks: x, y, z and visibility of every landmark
+    :param mirror: whether to flip x, to draw onto a mirrored frame
+    :param visibility: whether to set the visibility, mp_drawing skips landmarks with a low one.
+        MediaPipe hands leaves it unset, so it is 0 for every hand landmark.
+    :return: NormalizedLandmarkList
+    """
+    from mediapipe.framework.formats import landmark_pb2
+
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, landmark_visibility in landmarks.tolist():
+        landmark = landmark_list.landmark.add(x=1 - x if mirror else x, y=y, z=z)
+        if visibility:
+            landmark.visibility = landmark_visibility
+
+    return landmark_list
@@ -0,0 +1,115 @@
+import time
+
+import cv2
+import numpy as np
+
+OUTLINE_COLORS = ((0, 0, 0), (255, 255, 255))
+OUTLINE_THICKNESSES = (4, 2)
+# Seconds a layer whose text changes every frame, like the frame rate, keeps its text before it is rendered again
+REFRESH_INTERVAL = 0.5
+
+
+class TextLayer:
+    def __init__(self, text: str, org: tuple[int, int], scale: float, colors: tuple, thicknesses: tuple, font: int):
+        """
+        Text rendered once into a small patch with its own alpha mask.
+
+        :param text: text to render
+        :param org: bottom-left corner of the text in the frame, as for cv2.putText
+        :param scale: font scale
+        :param colors: color of each stroke, drawn in order
+        :param thicknesses: thickness of each stroke
+        :param font: OpenCV font face
+        """
+        (width, height), baseline = cv2.getTextSize(text, font, scale, max(thicknesses))
+        pad = max(thicknesses)
+        self.x = org[0] - pad
+        self.y = org[1] - height - pad
+
+        size = (height + baseline + 2 * pad, width + 2 * pad)
+        patch = np.zeros(size + (3,), dtype=np.uint8)
+        alpha = np.zeros(size, dtype=np.uint8)
+        for color, thickness in zip(colors, thicknesses):
+            cv2.putText(patch, text, (pad, pad + height), font, scale, color, thickness, cv2.LINE_AA)
+            cv2.putText(alpha, text, (pad, pad + height), font, scale, 255, thickness, cv2.LINE_AA)
+
+        # Only pixels the text covers are touched: opaque ones are copied, the anti-aliased edges blended
+        ys, xs = np.nonzero(alpha)
+        opaque = alpha[ys, xs] == 255
+        edge_alpha = alpha[ys[~opaque], xs[~opaque], np.newaxis].astype(np.uint16)
+        self.opaque = ys[opaque] + self.y, xs[opaque] + self.x, patch[ys[opaque], xs[opaque]]
+        self.edges = (ys[~opaque] + self.y, xs[~opaque] + self.x,
+                      patch[ys[~opaque], xs[~opaque]] * edge_alpha, 255 - edge_alpha)
+        self.clipped = {}
+
+    def pixels(self, shape: tuple[int, int]):
+        """Flat indices and values of the opaque and edge pixels that fall inside an image of the given shape"""
+        if shape not in self.clipped:
+            def clip(ys, xs, *values):
+                inside = (ys >= 0) & (ys < shape[0]) & (xs >= 0) & (xs < shape[1])
+                return (ys[inside] * shape[1] + xs[inside], *(value[inside] for value in values))
+
+            self.clipped[shape] = clip(*self.opaque), clip(*self.edges)
+
+        return self.clipped[shape]
+
+    def draw(self, image: np.ndarray):
+        """Blend the text onto a C-contiguous BGR image, as returned by OpenCV, in place"""
+        (opaque, colors), (edges, edge_colors, inverse_alpha) = self.pixels(image.shape[:2])
+        pixels = image.reshape(-1, 3)
+        pixels[opaque] = colors
+        pixels[edges] = (pixels[edges] * inverse_alpha + edge_colors) // 255
+
+
+class Overlay:
+    def __init__(self):
+        """
+        Cache of the text drawn over every frame.
+
+        Each piece of text is rendered only when its content changes, then blended onto every frame
+        from its cached patch. Rendering a layer costs about ten times as much as blending it, so text that changes
+        every frame, like the frame rate, is given an interval and only rendered again once it has passed.
+        """
+        self.layers = {}
+        self.keys = {}
+        self.rendered = {}
+
+    def text(self, name: str, text: str, org: tuple[int, int], scale: float, colors: tuple = OUTLINE_COLORS,
+             thicknesses: tuple = OUTLINE_THICKNESSES, font: int = cv2.FONT_HERSHEY_SIMPLEX, interval: float = 0):
+        """
+        Set the text of a layer, rendering it again only if anything changed.
+
+        :param name: name of the layer
+        :param text: text to show, None to hide the layer
+        :param org: bottom-left corner of the text in the frame, as for cv2.putText
+        :param scale: font scale
+        :param colors: color of each stroke, an outline and a fill by default
+        :param thicknesses: thickness of each stroke
+        :param font: OpenCV font face
+        :param interval: seconds to keep showing the previous text when only the text changed,
+            e.g. REFRESH_INTERVAL for text that changes every frame
+        :return:
+        """
+        if text is None:
+            self.layers.pop(name, None)
+            self.keys.pop(name, None)
+            return
+
+        key = (text, org, scale, colors, thicknesses, font)
+        previous = self.keys.get(name)
+        if previous == key:
+            return
+
+        now = time.perf_counter()
+        if previous is not None and previous[1:] == key[1:] and now - self.rendered[name] < interval:
+            return
+
+        self.layers[name] = TextLayer(text, org, scale, colors, thicknesses, font)
+        self.keys[name] = key
+        self.rendered[name] = now
+
+    def draw(self, image: np.ndarray) -> np.ndarray:
+        for layer in self.layers.values():
+            layer.draw(image)
+
+        return image
@@ -0,0 +1,122 @@
+import numpy as np
+
+# Library size from which querying the tree beats the batched linear scan, measured with benchmarks/pose_index.py
+# (0.8x at 100 poses, break-even around 700, 1.2x at 800 and 1.3x from 1000)
+INDEX_MIN_POSES = 800
+
+
+def best_poses(ratios: np.ndarray, pose_matrix: np.ndarray, pose_leniency: float, pose_threshold: float):
+    """
+    Score every hand against every pose in a single batched operation.
+
+    :param ratios: numpy array of shape (number of hands, number of landmarks)
+    :param pose_matrix: numpy array of shape (number of poses, number of landmarks)
+    :param pose_leniency: the leniency of the pose (0-1)
+    :param pose_threshold: the threshold of the pose (0-1)
+    :return: index of the best matching pose for each hand, -1 where no pose surpasses threshold
+    """
+    if not len(pose_matrix):
+        return np.full(len(ratios), -1)
+
+    wrong_threshold = ratios.shape[1] * (1 - pose_threshold)
+
+    # (hands, poses, landmarks)
+    deviations = np.abs(ratios[:, np.newaxis, :] - pose_matrix[np.newaxis, :, :])
+    wrong = np.count_nonzero(deviations > pose_leniency, axis=2)
+    scores = np.mean(deviations, axis=2)
+    scores[wrong > wrong_threshold] = np.inf
+
+    best = np.argmin(scores, axis=1)
+    best[~np.isfinite(scores[np.arange(len(ratios)), best])] = -1
+
+    return best
+
+
+class PoseIndex:
+    def __init__(self, pose_leniency: float = 0.3, pose_threshold: float = 0.99, rebuild_fraction: float = 0.1,
+                 min_rebuild: int = 32, min_poses: int = INDEX_MIN_POSES):
+        """
+        KD-tree over the saved pose vectors.
+
+        Poses appended after the last build are kept in an unindexed tail that is scanned linearly,
+        and the tree is rebuilt once the tail grows past a fraction of the library.
+        Smaller libraries than min_poses are not indexed and are scanned with best_poses.
+
+        :param pose_leniency: the leniency of the pose (0-1)
+        :param pose_threshold: the threshold of the pose (0-1)
+        :param rebuild_fraction: rebuild the tree once the tail is this fraction of the indexed poses
+        :param min_rebuild: never rebuild for a tail smaller than this
+        :param min_poses: smallest library the tree is built for
+        """
+        self.pose_leniency = pose_leniency
+        self.pose_threshold = pose_threshold
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self.min_poses = min_poses
+        self.tree = None
+        self.indexed = 0
+
+    def update(self, pose_matrix: np.ndarray):
+        """
+        Bring the index up to date after poses were added or cleared.
+
+        :param pose_matrix: the full pose library, with new poses appended at the end
+        :return:
+        """
+        if len(pose_matrix) < self.indexed:
+            self.tree = None
+            self.indexed = 0
+
+        # A small library is scanned faster than the tree is queried
+        if len(pose_matrix) < self.min_poses:
+            return
+
+        tail = len(pose_matrix) - self.indexed
+        if self.tree is None or tail > max(self.min_rebuild, self.rebuild_fraction * self.indexed):
+            from scipy.spatial import cKDTree
+
+            self.tree = cKDTree(pose_matrix) if len(pose_matrix) else None
+            self.indexed = len(pose_matrix)
+
+    def candidates(self, ratios: np.ndarray, pose_matrix: np.ndarray) -> list[np.ndarray]:
+        """
+        Retrieve the poses that could pass the leniency/threshold rule for each hand.
+
+        A pose with no landmark outside the leniency lies within an L-infinity ball of radius
+        pose_leniency, which the tree answers directly. When the threshold lets some landmarks be
+        wrong there is no such bound, so every pose is a candidate.
+
+        :param ratios: numpy array of shape (number of hands, number of landmarks)
+        :param pose_matrix: the full pose library
+        :return: sorted candidate pose indices for each hand
+        """
+        wrong_threshold = ratios.shape[1] * (1 - self.pose_threshold)
+        if self.tree is None or wrong_threshold >= 1:
+            return [np.arange(len(pose_matrix))] * len(ratios)
+
+        tail = np.arange(self.indexed, len(pose_matrix))
+        found = self.tree.query_ball_point(ratios, r=self.pose_leniency, p=np.inf)
+
+        return [np.concatenate((np.sort(np.array(indices, dtype=int)), tail)) for indices in found]
+
+    def query(self, ratios: np.ndarray, pose_matrix: np.ndarray) -> np.ndarray:
+        """
+        Find the best matching pose for each hand, re-checking candidates with the exact rule.
+
+        :param ratios: numpy array of shape (number of hands, number of landmarks)
+        :param pose_matrix: the full pose library
+        :return: index of the best matching pose for each hand, -1 where no pose surpasses threshold
+        """
+        if self.tree is None:
+            return best_poses(ratios, pose_matrix, self.pose_leniency, self.pose_threshold)
+
+        best = np.full(len(ratios), -1)
+        for hand, indices in enumerate(self.candidates(ratios, pose_matrix)):
+            if not len(indices):
+                continue
+
+            match = best_poses(ratios[hand:hand + 1], pose_matrix[indices], self.pose_leniency, self.pose_threshold)[0]
+            if match >= 0:
+                best[hand] = indices[match]
+
+        return best
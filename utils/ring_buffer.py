@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class PointRingBuffer:
+    def __init__(self, capacity: int, landmark_ids: list[int], dims: int = 2):
+        """
+        Preallocated circular buffer of landmark positions.
+
+        Every frame is written twice, capacity frames apart, so the newest `capacity` frames are always
+        one contiguous slice and can be returned in time order without copying.
+
+        :param capacity: number of frames to keep
+        :param landmark_ids: ids of the landmarks stored, in row order
+        :param dims: number of coordinates per landmark
+        """
+        self.capacity = capacity
+        self.landmark_ids = list(landmark_ids)
+        self.rows = {landmark_id: row for row, landmark_id in enumerate(self.landmark_ids)}
+        self.points = np.zeros((2 * capacity, len(self.landmark_ids), dims), dtype=np.float32)
+        self.visible = np.zeros((2 * capacity, len(self.landmark_ids)), dtype=bool)
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, points: np.ndarray, visible: np.ndarray):
+        """
+        Add the positions of every landmark for a new frame, overwriting the oldest frame when full.
+
+        :param points: numpy array of shape (landmarks, dims)
+        :param visible: numpy array of shape (landmarks,), whether each landmark was visible
+        :return:
+        """
+        self.points[self.head] = self.points[self.head + self.capacity] = points
+        self.visible[self.head] = self.visible[self.head + self.capacity] = visible
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def clear(self):
+        self.size = 0
+
+    def view(self) -> np.ndarray:
+        """Time-ordered view of the stored frames, of shape (frames, landmarks, dims)"""
+        end = self.head + self.capacity
+        return self.points[end - self.size:end]
+
+    def visible_view(self) -> np.ndarray:
+        """Time-ordered view of the visibility mask, of shape (frames, landmarks)"""
+        end = self.head + self.capacity
+        return self.visible[end - self.size:end]
+
+    def latest(self) -> np.ndarray:
+        """Positions of every landmark in the newest frame, of shape (landmarks, dims)"""
+        return self.points[self.head + self.capacity - 1]
+
+    def history(self, landmark_ids: list[int] = None) -> np.ndarray:
+        """
+        Trajectories of the given landmarks, of shape (landmarks, frames, dims).
+
+        :param landmark_ids: landmarks to return, all of them if None
+        :return: a view when all landmarks are requested, a copy otherwise
+        """
+        trajectories = self.view().transpose(1, 0, 2)
+        if landmark_ids is None:
+            return trajectories
+
+        return trajectories[[self.rows[landmark_id] for landmark_id in landmark_ids]]
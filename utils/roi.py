@@ -0,0 +1,110 @@
+import cv2
+import numpy as np
+
+from utils.landmarks import found_rows
+
+ROI_MARGIN = 0.3
+ROI_MAX_SIDE = 320
+ROI_MIN_SIDE = 96
+# Hands entering outside the region are only found by a periodic full-frame detection
+ROI_REFRESH_INTERVAL = 30
+
+
+class RegionOfInterest:
+    def __init__(self, margin: float = ROI_MARGIN, max_side: int = ROI_MAX_SIDE, min_side: int = ROI_MIN_SIDE,
+                 refresh_interval: int = ROI_REFRESH_INTERVAL):
+        """
+        Crop and downscale frames around the landmarks of the previous frame before inference.
+
+        The whole frame is used at its own resolution while nothing is tracked, and every refresh_interval frames
+        so that a hand entering outside the region is still found. Every switch between the whole frame and the
+        region restarts the model's own tracking, so a single pose should only refresh once it is lost. The region
+        only moves once the landmarks leave it or it becomes much larger than needed, which keeps that tracking stable.
+
+        :param margin: fraction of the landmarks' bounding box added on every side
+        :param max_side: longest side the cropped region is downscaled to
+        :param min_side: smallest side of the region in frame pixels
+        :param refresh_interval: number of frames between two full-frame detections, None to only use the whole
+            frame while nothing is tracked
+        """
+        self.margin = margin
+        self.max_side = max_side
+        self.min_side = min_side
+        self.refresh_interval = refresh_interval
+        self.box = None
+        self.region = None
+        self.frame_size = None
+        self.frames = 0
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Cut the region to run inference on out of the frame.
+
+        :param frame: full frame
+        :return: the whole frame, a view of the region, or a downscaled copy of the region if it is larger
+            than max_side
+        """
+        height, width = frame.shape[:2]
+        self.frame_size = width, height
+        self.frames += 1
+
+        # Downscaling the whole frame would shorten the range at which a lost subject is found again
+        if self.box is None or (self.refresh_interval and self.frames % self.refresh_interval == 0):
+            self.region = 0, 0, width, height
+            return frame
+
+        self.region = self.box
+
+        x0, y0, x1, y1 = self.region
+        image = frame[y0:y1, x0:x1]
+
+        scale = self.max_side / max(x1 - x0, y1 - y0)
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        return image
+
+    def to_frame(self, landmarks: np.ndarray):
+        """Map normalized (..., landmarks, 4) landmarks of the cropped image back to full-frame coordinates, in place"""
+        x0, y0, x1, y1 = self.region
+        width, height = self.frame_size
+        if (x0, y0, x1, y1) == (0, 0, width, height):
+            return
+
+        # z uses roughly the same scale as x
+        landmarks[..., 0] = (x0 + landmarks[..., 0] * (x1 - x0)) / width
+        landmarks[..., 1] = (y0 + landmarks[..., 1] * (y1 - y0)) / height
+        landmarks[..., 2] *= (x1 - x0) / width
+
+    def update(self, landmarks: np.ndarray):
+        """
+        Move the region around the full-frame landmarks of this frame.
+
+        :param landmarks: (hands or poses, landmarks, 4) normalized landmarks already mapped with to_frame,
+            NaN rows for the ones not found
+        :return:
+        """
+        landmarks = found_rows(landmarks)
+        if not len(landmarks):
+            self.box = None
+            return
+
+        width, height = self.frame_size
+        points = landmarks[..., :2].reshape(-1, 2).astype(float) * (width, height)
+        lower, upper = points.min(axis=0), points.max(axis=0)
+
+        # Grow the box by the margin, keeping it at least min_side wide and tall
+        padding = np.maximum((upper - lower) * self.margin, (self.min_side - (upper - lower)) / 2)
+        x0, y0 = np.clip(lower - padding, 0, None).astype(int)
+        x1, y1 = np.minimum(upper + padding, (width, height)).astype(int)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            self.box = None
+            return
+
+        if self.box is not None:
+            bx0, by0, bx1, by1 = self.box
+            contained = bx0 <= lower[0] and by0 <= lower[1] and upper[0] <= bx1 and upper[1] <= by1
+            if contained and (bx1 - bx0) * (by1 - by0) < 4 * (x1 - x0) * (y1 - y0):
+                return
+
+        self.box = x0, y0, x1, y1
@@ -0,0 +1,169 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Slot data starts on a cache line boundary after the header
+ALIGNMENT = 64
+
+
+class SharedRing:
+    def __init__(self, shape: tuple, dtype=np.uint8, slots: int = 4, readers: int = 1):
+        """
+        Ring of fixed-size array slots in one block of shared memory, passed between processes without copying.
+
+        A writer claims the oldest slot no reader holds, fills it in place and publishes it with a sequence number.
+        A reader holds the slot it acquired until it releases it or acquires another, so the slot is never
+        overwritten while in use. Only the slot bookkeeping is locked, never the data itself.
+
+        The ring can be passed to a multiprocessing.Process, which attaches to the same memory.
+        Only the process that created it unlinks the memory, in dispose().
+
+        :param shape: shape of the array in each slot
+        :param dtype: dtype of the arrays
+        :param slots: number of slots, at least two more than readers so a writer always finds a free one
+        :param readers: number of readers that may hold a slot at the same time, there is a single writer
+        """
+        if slots < readers + 2:
+            raise ValueError(f'{readers} readers need at least {readers + 2} slots, got {slots}')
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.readers = readers
+        self.condition = multiprocessing.Condition()
+
+        header_size, slot_size = self._layout()
+        self.memory = shared_memory.SharedMemory(create=True, size=header_size + slots * slot_size)
+        self.owner = True
+        self._attach()
+        self.header[:] = 0
+        self.held[:] = -1
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'dtype': self.dtype, 'slots': self.slots, 'readers': self.readers,
+                'condition': self.condition, 'name': self.memory.name}
+
+    def __setstate__(self, state):
+        name = state.pop('name')
+        self.__dict__.update(state)
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.owner = False
+        self._attach()
+
+    def _layout(self) -> tuple[int, int]:
+        """Size in bytes of the header and of each slot, both rounded up to the alignment"""
+        header_size = (2 + 2 * self.slots + self.readers) * 8
+        slot_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        return -(-header_size // ALIGNMENT) * ALIGNMENT, -(-slot_size // ALIGNMENT) * ALIGNMENT
+
+    def _attach(self):
+        """Create the views of the header and the slots on the shared memory"""
+        header_size, slot_size = self._layout()
+
+        # Header: latest sequence, closed flag, sequence and tag of each slot, slot held by each reader
+        self.header = np.ndarray(2 + 2 * self.slots + self.readers, dtype=np.int64, buffer=self.memory.buf)
+        self.sequences = self.header[2:2 + self.slots]
+        self.tags = self.header[2 + self.slots:2 + 2 * self.slots]
+        self.held = self.header[2 + 2 * self.slots:]
+        self.data = [np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf,
+                                offset=header_size + slot * slot_size) for slot in range(self.slots)]
+
+    @property
+    def latest(self) -> int:
+        """Sequence number of the newest published slot, 0 before the first one"""
+        return int(self.header[0])
+
+    @property
+    def closed(self) -> bool:
+        return bool(self.header[1])
+
+    def claim(self) -> tuple[int, np.ndarray]:
+        """
+        Take the oldest slot that is neither held by a reader nor the newest one, to be filled in place.
+
+        :return: tuple of (slot, writable view of the slot)
+        """
+        with self.condition:
+            free = [slot for slot in range(self.slots)
+                    if slot not in self.held and (self.sequences[slot] != self.header[0] or not self.header[0])]
+            slot = min(free, key=lambda index: self.sequences[index])
+            # A slot being written matches no sequence, so no reader can acquire it
+            self.sequences[slot] = -1
+
+        return slot, self.data[slot]
+
+    def publish(self, slot: int, tag: int = 0):
+        """
+        Make a claimed slot the newest one and wake up the waiting readers.
+
+        :param slot: slot returned by claim
+        :param tag: number stored with the slot, e.g. the sequence of the frame some landmarks were found in
+        :return:
+        """
+        with self.condition:
+            self.header[0] += 1
+            self.sequences[slot] = self.header[0]
+            self.tags[slot] = tag
+            self.condition.notify_all()
+
+    def acquire(self, reader: int, after: int = 0, timeout: float = None) -> tuple[int, int, np.ndarray]:
+        """
+        Wait for a slot newer than `after` and hold the newest one, releasing the slot held before.
+
+        :param reader: index of the reader, below the number of readers of the ring
+        :param after: sequence of the last slot the reader has seen
+        :param timeout: maximum number of seconds to wait, None to wait forever
+        :return: tuple of (sequence, tag, read-only view), (after, 0, None) if nothing new arrived or the ring closed
+        """
+        with self.condition:
+            self.held[reader] = -1
+            self.condition.wait_for(lambda: self.header[0] > after or self.header[1], timeout)
+            if self.header[0] <= after:
+                return after, 0, None
+
+            return self._hold(reader, int(self.header[0]))
+
+    def acquire_sequence(self, reader: int, sequence: int) -> tuple[int, int, np.ndarray]:
+        """
+        Hold the slot with the given sequence if it has not been overwritten yet, releasing the slot held before.
+
+        :return: tuple of (sequence, tag, read-only view), (sequence, 0, None) if the slot is gone
+        """
+        with self.condition:
+            self.held[reader] = -1
+            if sequence not in self.sequences:
+                return sequence, 0, None
+
+            return self._hold(reader, sequence)
+
+    def _hold(self, reader: int, sequence: int) -> tuple[int, int, np.ndarray]:
+        slot = int(np.flatnonzero(self.sequences == sequence)[0])
+        self.held[reader] = slot
+
+        view = self.data[slot].view()
+        view.flags.writeable = False
+        return sequence, int(self.tags[slot]), view
+
+    def release(self, reader: int):
+        with self.condition:
+            self.held[reader] = -1
+
+    def close(self):
+        """Tell every reader that nothing more will be published, waking the ones that wait"""
+        with self.condition:
+            self.header[1] = 1
+            self.condition.notify_all()
+
+    def dispose(self):
+        """Detach from the shared memory and, in the process that created it, free it"""
+        self.header = self.sequences = self.tags = self.held = None
+        self.data = []
+        try:
+            self.memory.close()
+        except BufferError:
+            # A view handed out is still alive, the memory is freed with the process instead
+            pass
+
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,148 @@
+"""
+Streaming gesture spotting with subsequence DTW, following SPRING (Sakurai et al., 2007).
+Each new frame updates one cumulative-cost column per template. Since the costs are taken relative to the start
+of each path, see SpringSpotter, a frame costs O(template length x distinct starts in the column), at most
+O(template length ^ 2), which does not depend on how long the stream or the window is.
+"""
+
+import numpy as np
+
+
+def stack_template(points: dict[..., list], landmark_ids: list, length: int) -> np.ndarray:
+    """Resample the trajectory of each landmark to a common length and stack them into a (length, landmarks, 2) array"""
+    template = np.empty((length, len(landmark_ids), 2))
+
+    samples = np.linspace(0, 1, length)
+    for index, landmark_id in enumerate(landmark_ids):
+        trajectory = np.asarray(points[landmark_id], dtype=float)
+        positions = np.linspace(0, 1, len(trajectory))
+        template[:, index, 0] = np.interp(samples, positions, trajectory[:, 0])
+        template[:, index, 1] = np.interp(samples, positions, trajectory[:, 1])
+
+    return template
+
+
+class RunningMean:
+    def __init__(self, window: int, shape: tuple):
+        """
+        Mean of the last `window` samples, updated in O(1) per sample.
+
+        :param window: number of samples to average over
+        :param shape: shape of a single sample
+        """
+        self.samples = np.zeros((window,) + shape)
+        self.total = np.zeros(shape)
+        self.count = 0
+
+    def update(self, sample: np.ndarray) -> np.ndarray:
+        slot = self.count % len(self.samples)
+        if self.count >= len(self.samples):
+            self.total -= self.samples[slot]
+
+        self.samples[slot] = sample
+        self.total += sample
+        self.count += 1
+
+        return self.total / min(self.count, len(self.samples))
+
+    def reset(self):
+        self.total[:] = 0
+        self.count = 0
+
+
+class SpringSpotter:
+    def __init__(self, template: np.ndarray, epsilon: float, max_length: int = None):
+        """
+        Spot subsequences of a stream that match a template under DTW, wherever they are performed.
+
+        A template is centred on the gesture it was recorded from, which a stream only knows once the gesture
+        has ended. The template and every candidate subsequence are therefore both taken relative to their
+        first point, the start of each candidate being tracked along with its cumulative cost.
+
+        This makes the spotting an approximation of subsequence DTW. The cost of a frame depends on where
+        the path through it started, but every cell only keeps the path that is cheapest including that frame,
+        so a path that costs more so far but would be cheaper later is lost and optimal substructure no longer
+        holds. The costs of a frame are computed once for every start the column holds. There are at most
+        min(template length + 1, max_length) such starts, one per cell, and starts older than max_length frames
+        are dropped.
+
+        :param template: numpy array of shape (length, landmarks, dims)
+        :param epsilon: maximum DTW distance of a match
+        :param max_length: maximum number of frames of a match, twice the template length if None
+        """
+        self.template = template - template[0]
+        self.epsilon = epsilon
+        self.max_length = max_length or 2 * len(template)
+        # Points of the last max_length frames, by frame modulo max_length, NaN if the frame was unusable
+        self.points = np.full((self.max_length,) + template.shape[1:], np.nan)
+        self.time = 0
+        self.distances = np.full(len(template) + 1, np.inf)
+        self.distances[0] = 0
+        self.starts = np.zeros(len(template) + 1, dtype=int)
+        self.best = np.inf
+        self.best_start = 0
+        self.best_end = 0
+
+    def reset(self):
+        self.distances[1:] = np.inf
+        self.best = np.inf
+
+    def update(self, point: np.ndarray = None):
+        """
+        Feed the next frame of the stream.
+
+        :param point: numpy array of shape (landmarks, dims), None if the frame is unusable
+        :return: tuple of (distance, start frame, end frame) once a match is final, None otherwise
+        """
+        t = self.time
+        self.time += 1
+        self.points[t % self.max_length] = np.nan if point is None else point
+
+        # Python floats are much faster than NumPy scalars in the loop below
+        previous_distances, previous_starts = self.distances.tolist(), self.starts.tolist()
+
+        # Cost of every template point against this frame, for a path starting at each frame a path can start at
+        candidates = sorted(set(previous_starts) | {t})
+        if point is None:
+            costs = np.full((len(candidates), len(self.template)), np.inf)
+        else:
+            # Sum the euclidean distance of every landmark
+            relative = point - self.points[[candidate % self.max_length for candidate in candidates]]
+            costs = np.linalg.norm(self.template - relative[:, np.newaxis], axis=3).sum(axis=2)
+            costs[np.isnan(costs)] = np.inf
+        costs = dict(zip(candidates, costs.tolist()))
+
+        distances = [0.0]
+        starts = [t]
+
+        for i in range(1, len(previous_distances)):
+            # The cost of this frame depends on where the path it extends started
+            best, start = np.inf, t
+            for distance, candidate in ((distances[i - 1], starts[i - 1]), (previous_distances[i], previous_starts[i]),
+                                        (previous_distances[i - 1], previous_starts[i - 1])):
+                # The start of a longer match has been overwritten
+                if distance < best and t - candidate < self.max_length:
+                    distance += costs[candidate][i - 1]
+                    if distance < best:
+                        best, start = distance, candidate
+
+            distances.append(best)
+            starts.append(start)
+
+        distances = np.array(distances)
+        starts = np.array(starts)
+
+        match = None
+        if self.best <= self.epsilon:
+            # The match is final once no running path that overlaps it can still beat it
+            running = (distances[1:] < self.best) & (starts[1:] <= self.best_end)
+            if not running.any():
+                match = (self.best, self.best_start, self.best_end)
+                self.best = np.inf
+                distances[1:][starts[1:] <= self.best_end] = np.inf
+
+        if distances[-1] <= self.epsilon and distances[-1] < self.best:
+            self.best, self.best_start, self.best_end = distances[-1], starts[-1], t
+
+        self.distances, self.starts = distances, starts
+        return match
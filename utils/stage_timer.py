@@ -0,0 +1,111 @@
+import csv
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+STAGE_WINDOW = 300
+DUMP_INTERVAL = 5.0
+
+
+class StageTimer:
+    def __init__(self, enabled: bool = False, overlay: bool = False, dump_path: str = None,
+                 dump_interval: float = DUMP_INTERVAL, window: int = STAGE_WINDOW):
+        """
+        Time the stages of a live loop and keep the last `window` frames of each stage for percentiles.
+
+        Call start() at the top of a frame, lap(stage) after each stage and end_frame() at the bottom.
+        A stage lapped several times in a frame is summed. When disabled, every call returns immediately.
+
+        :param enabled: whether to record timings at all
+        :param overlay: whether draw() writes the percentiles onto the frame
+        :param dump_path: .json or .csv file the percentiles are written to every dump_interval seconds
+        :param dump_interval: seconds between two dumps
+        :param window: number of frames the percentiles are computed over
+        """
+        self.enabled = enabled
+        self.overlay = overlay and enabled
+        self.dump_path = dump_path if enabled else None
+        self.dump_interval = dump_interval
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+        self.frame = {}
+        self.last = 0.0
+        self.frame_start = 0.0
+        self.last_dump = time.perf_counter()
+
+    def start(self):
+        if not self.enabled:
+            return
+
+        self.frame.clear()
+        self.last = self.frame_start = time.perf_counter()
+
+    def lap(self, stage: str):
+        """Attribute the time since the previous lap to the stage"""
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        self.frame[stage] = self.frame.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+
+        self.frame['frame'] = time.perf_counter() - self.frame_start
+        for stage, seconds in self.frame.items():
+            if stage not in self.samples:
+                self.samples[stage] = np.zeros(self.window)
+                self.counts[stage] = 0
+
+            self.samples[stage][self.counts[stage] % self.window] = seconds * 1000
+            self.counts[stage] += 1
+
+        if self.dump_path and self.last - self.last_dump >= self.dump_interval:
+            self.dump()
+            self.last_dump = self.last
+
+    def percentiles(self) -> dict[str, dict[str, float]]:
+        """p50, p95 and p99 of each stage in milliseconds, over the last `window` frames"""
+        summary = {}
+        for stage, samples in self.samples.items():
+            count = self.counts[stage]
+            p50, p95, p99 = np.percentile(samples[:min(count, self.window)], (50, 95, 99))
+            summary[stage] = {'count': count, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+
+        return summary
+
+    def dump(self):
+        """Write the percentiles to dump_path, as CSV if it ends with .csv and as JSON otherwise"""
+        summary = self.percentiles()
+        os.makedirs(os.path.dirname(self.dump_path) or '.', exist_ok=True)
+
+        temporary = self.dump_path + '.tmp'
+        with open(temporary, 'w', newline='') as f:
+            if self.dump_path.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(('stage', 'count', 'p50_ms', 'p95_ms', 'p99_ms'))
+                for stage, values in summary.items():
+                    writer.writerow((stage, *values.values()))
+            else:
+                json.dump({'time': time.time(), 'stages': summary}, f, indent=4)
+        os.replace(temporary, self.dump_path)
+
+    def draw(self, image):
+        """Write the percentiles of each stage in the top right corner of the image"""
+        if not self.overlay:
+            return image
+
+        x = image.shape[1] - 330
+        for row, (stage, values) in enumerate(self.percentiles().items()):
+            text = f'{stage:<10}{values["p50_ms"]:6.1f}{values["p95_ms"]:6.1f}{values["p99_ms"]:6.1f}'
+            cv2.putText(image, text, (x, 30 + row * 20), cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 0, 0), 3, cv2.LINE_AA)
+            cv2.putText(image, text, (x, 30 + row * 20), cv2.FONT_HERSHEY_PLAIN, 1.0, (255, 255, 255), 1,
+                        cv2.LINE_AA)
+
+        return image
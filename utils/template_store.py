@@ -0,0 +1,195 @@
+"""
+Versioned binary library of gesture and pose templates.
+
+A library is a directory holding data.f32, every template's values as raw float32 appended one after
+the other, and manifest.json, which records the name, kind, landmark ids and offset of each template.
+Templates are only ever appended, so the data file can be memory-mapped and shared by several tracker
+processes while new templates are added.
+
+Convert the JSON templates with:
+python -m utils.template_store import
+python -m utils.template_store export
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+LIBRARY_DIR = 'data/models/library'
+LIBRARY_VERSION = 1
+
+
+def load_json(path: str):
+    """Load a JSON template, None if the file is empty or not valid JSON"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f'Skipping {path}: not a valid template')
+        return None
+
+
+class TemplateLibrary:
+    def __init__(self, path: str = LIBRARY_DIR):
+        """
+        Open a template library.
+
+        :param path: directory of the library, created on the first append
+        """
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self.data_path = os.path.join(path, 'data.f32')
+        self.manifest = {'version': LIBRARY_VERSION, 'size': 0, 'entries': []}
+        self.data = None
+
+        if self.exists:
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+
+            if self.manifest['version'] != LIBRARY_VERSION:
+                raise ValueError(f'Unsupported template library version {self.manifest["version"]}')
+
+    @property
+    def exists(self) -> bool:
+        return os.path.isfile(self.manifest_path)
+
+    def entries(self, kind: str) -> list[dict]:
+        return [entry for entry in self.manifest['entries'] if entry['kind'] == kind]
+
+    def values(self) -> np.ndarray:
+        """Memory-mapped float32 values of every template"""
+        if self.data is None:
+            # Values past the manifest size belong to an append in progress
+            size = self.manifest['size']
+            self.data = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(size,)) if size \
+                else np.empty(0, dtype=np.float32)
+
+        return self.data
+
+    def append(self, kind: str, name: str, values: np.ndarray, **metadata):
+        """
+        Append a template to the library.
+
+        :param kind: 'gesture' or 'pose'
+        :param name: name of the template
+        :param values: values of the template, stored as float32
+        :param metadata: extra fields to store in the manifest entry
+        :return:
+        """
+        os.makedirs(self.path, exist_ok=True)
+
+        values = np.ascontiguousarray(values, dtype=np.float32).ravel()
+        with open(self.data_path, 'ab') as f:
+            f.seek(self.manifest['size'] * 4)
+            f.truncate()
+            f.write(values.tobytes())
+
+        self.manifest['entries'].append({'kind': kind, 'name': name, 'offset': self.manifest['size'], **metadata})
+        self.manifest['size'] += len(values)
+
+        # Replace the manifest in one step so readers never see a partial one
+        temporary = self.manifest_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(temporary, self.manifest_path)
+
+        self.data = None
+
+    def append_gesture(self, name: str, points: dict, **metadata):
+        """
+        Append a gesture template.
+
+        :param name: name of the gesture
+        :param points: simplified (x, y) or (x, y, z) points for each landmark id
+        :param metadata: extra fields to store in the manifest entry, e.g. a threshold
+        :return:
+        """
+        arrays = [np.asarray(landmark_points, dtype=np.float32) for landmark_points in points.values()]
+        dims = arrays[0].shape[-1] if arrays and arrays[0].ndim == 2 else 2
+        arrays = [array.reshape(-1, dims) for array in arrays]
+        self.append('gesture', name, np.concatenate(arrays) if arrays else np.empty(0),
+                    landmarks=[int(idx) for idx in points.keys()], lengths=[len(array) for array in arrays],
+                    dims=dims, **metadata)
+
+    def append_pose(self, name: str, ratios: np.ndarray):
+        self.append('pose', name, ratios, length=len(ratios))
+
+    def gestures(self) -> list[dict]:
+        """
+        Load the gesture templates as memory-mapped views.
+
+        :return: list of {"name", "points", "duration"} dicts, with a (points, dims) array for each landmark id
+            and the (shortest, longest) number of frames the gesture takes, None if it was not declared
+        """
+        values = self.values()
+        gestures = []
+        for entry in self.entries('gesture'):
+            points = {}
+            offset = entry['offset']
+            # Entries written before 3D templates existed have no dims
+            dims = entry.get('dims', 2)
+            for landmark_id, length in zip(entry['landmarks'], entry['lengths']):
+                points[str(landmark_id)] = values[offset:offset + length * dims].reshape(length, dims)
+                offset += length * dims
+
+            gestures.append({'name': entry['name'], 'points': points, 'duration': entry.get('duration')})
+
+        return gestures
+
+    def poses(self) -> dict[str, np.ndarray]:
+        """Load the pose templates as memory-mapped views, keyed by name"""
+        values = self.values()
+        return {entry['name']: values[entry['offset']:entry['offset'] + entry['length']]
+                for entry in self.entries('pose')}
+
+
+def import_json(library: TemplateLibrary, gestures_dir: str, poses_dir: str):
+    """Append every JSON gesture and pose template to the library, skipping names it already holds"""
+    gestures = {(entry['name'], entry.get('dims', 2)) for entry in library.entries('gesture')}
+    for file in sorted(os.listdir(gestures_dir)) if os.path.isdir(gestures_dir) else []:
+        if file.endswith('.json') and (data := load_json(os.path.join(gestures_dir, file))):
+            points = data.get('points') or data
+            dims = np.shape(next(iter(points.values()), [[0, 0]]))[-1]
+            if (name := data.get('name') or file[:-5], dims) not in gestures:
+                metadata = {'duration': data['duration']} if data.get('duration') else {}
+                library.append_gesture(name, points, **metadata)
+
+    poses = {entry['name'] for entry in library.entries('pose')}
+    for file in sorted(os.listdir(poses_dir)) if os.path.isdir(poses_dir) else []:
+        if file.endswith('.json') and file[:-5] not in poses and (data := load_json(os.path.join(poses_dir, file))):
+            library.append_pose(file[:-5], np.array(data))
+
+
+def export_json(library: TemplateLibrary, gestures_dir: str, poses_dir: str):
+    """Write every template of the library back to JSON files"""
+    os.makedirs(gestures_dir, exist_ok=True)
+    os.makedirs(poses_dir, exist_ok=True)
+
+    for gesture in library.gestures():
+        points = {landmark_id: array.tolist() for landmark_id, array in gesture['points'].items()}
+        suffix = '_3d' if any(array.shape[-1] == 3 for array in gesture['points'].values()) else ''
+        data = {'name': gesture['name'], 'points': points}
+        if gesture['duration']:
+            data['duration'] = gesture['duration']
+        with open(os.path.join(gestures_dir, f'{gesture["name"]}{suffix}.json'), 'w') as f:
+            json.dump(data, f, indent=4)
+
+    for name, ratios in library.poses().items():
+        with open(os.path.join(poses_dir, f'{name}.json'), 'w') as f:
+            json.dump(ratios.tolist(), f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert templates between JSON files and a binary library.')
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('--library', default=LIBRARY_DIR)
+    parser.add_argument('--gestures', default='data/models/gestures')
+    parser.add_argument('--poses', default='data/models/poses')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        import_json(TemplateLibrary(args.library), args.gestures, args.poses)
+    else:
+        export_json(TemplateLibrary(args.library), args.gestures, args.poses)
@@ -1,6 +1,6 @@
+from functools import lru_cache
+
 import numpy as np
-from matplotlib import pyplot as plt
-from scipy.signal import savgol_filter
 
 
 def normalize_gesture(gesture: np.ndarray):
@@ -69,13 +69,151 @@ def gaussian_filter(points: np.ndarray, sigma: float = 1.0):
     return np.column_stack((x_values, y_values))
 
 
+@lru_cache(maxsize=None)
+def savgol_coefficients(window_length: int, polyorder: int):
+    """
+    Convolution coefficients of a Savitzky-Golay filter, the same as scipy.signal.savgol_coeffs.
+
+    scipy.signal takes a third of a second to import, longer than the rest of the tracker's dependencies together,
+    while the coefficients are a small least squares fit.
+
+    :param window_length: length of the filter window
+    :param polyorder: order of the polynomial fitted to each window
+    :return: numpy array of shape (window_length,)
+    """
+    halflen, rem = divmod(window_length, 2)
+    pos = halflen if rem else halflen - 0.5
+    # Reversed, to be used with convolve1d
+    x = np.arange(-pos, window_length - pos, dtype=float)[::-1]
+    target = np.zeros(polyorder + 1)
+    target[0] = 1
+    return np.linalg.lstsq(x ** np.arange(polyorder + 1)[:, np.newaxis], target, rcond=None)[0]
+
+
 def savgol_filter_points(points: np.ndarray, window_length: int, polyorder: int):
     """Apply a Savitzky-Golay filter to the given points"""
-    x_values, y_values = points.T
-    x_values = savgol_filter(x_values, window_length, polyorder, mode='nearest')
-    y_values = savgol_filter(y_values, window_length, polyorder, mode='nearest')
+    return savgol_filter_batch(np.asarray(points, dtype=float)[np.newaxis], window_length, polyorder)[0]
 
-    return np.column_stack((x_values, y_values))
+
+def gaussian_filter_batch(points: np.ndarray, sigma: float = 1.0):
+    """Apply a Gaussian filter to the (landmarks, time, dims) points of every landmark at once"""
+    kernel = np.exp(-np.arange(-3, 4) ** 2 / (2 * sigma ** 2))
+    kernel = kernel / np.sum(kernel)
+
+    # scipy.ndimage takes longer to import than the rest of the tracker, and is not needed before a window is full
+    from scipy.ndimage import convolve1d
+
+    # Zero padding matches np.convolve(..., mode='same')
+    return convolve1d(points, kernel, axis=1, mode='constant', cval=0.0)
+
+
+def savgol_filter_batch(points: np.ndarray, window_length: int, polyorder: int):
+    """Apply a Savitzky-Golay filter to the (landmarks, time, dims) points of every landmark at once"""
+    from scipy.ndimage import convolve1d
+
+    return convolve1d(points, savgol_coefficients(window_length, polyorder), axis=1, mode='nearest')
+
+
+def simplify_gesture_batch(points: np.ndarray, tolerance: float, starts: np.ndarray = None):
+    """
+    Simplify the (landmarks, time, dims) points of every landmark with the Ramer-Douglas-Peucker algorithm.
+    Segments are split level by level for all landmarks at once instead of recursively.
+    Returns a (landmarks, time) mask of the points simplify_gesture keeps, including its handling of
+    segments that are split next to an end point. With 3 dims, distances are measured in 3D.
+    With starts, the trajectory of each landmark begins at its own index and earlier points are ignored,
+    so trajectories of different lengths, aligned on their last point, are simplified together.
+    """
+    num_landmarks, length = points.shape[:2]
+    starts = np.zeros(num_landmarks, dtype=int) if starts is None else np.asarray(starts, dtype=int)
+    rows = np.arange(num_landmarks)[:, np.newaxis]
+    mask = np.zeros((num_landmarks, length), dtype=bool)
+    if length < 3:
+        if length:
+            mask[rows[:, 0], starts] = length - starts == 2
+        return mask
+
+    positions = np.broadcast_to(np.arange(length), (num_landmarks, length))
+    ignored = positions < starts[:, np.newaxis]
+    keep = mask.copy()
+    keep[rows[:, 0], starts] = True
+    keep[:, -1] = True
+
+    while True:
+        # Each point belongs to the segment between the closest kept points on either side
+        start = np.maximum.accumulate(np.where(keep, positions, 0), axis=1)
+        end = np.minimum.accumulate(np.where(keep, positions, length - 1)[:, ::-1], axis=1)[:, ::-1]
+
+        line = points[rows, end] - points[rows, start]
+        offset = points - points[rows, start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if points.shape[2] == 2:
+                distance = (np.abs(line[..., 0] * offset[..., 1] - line[..., 1] * offset[..., 0]) /
+                            np.sqrt(line[..., 0] ** 2 + line[..., 1] ** 2))
+            else:
+                # Pythagoras on the offset and its projection onto the segment works in any number of dims
+                projection = np.einsum('...i,...i->...', offset, line)
+                distance = np.sqrt(np.maximum(np.einsum('...i,...i->...', offset, offset) -
+                                              projection ** 2 / np.einsum('...i,...i->...', line, line), 0))
+        distance[keep | ignored | np.isnan(distance)] = 0
+
+        # Segment ids never decrease along the flattened rows, so each segment is one contiguous run
+        distance = distance.ravel()
+        segment = (rows * length + start).ravel()
+        bounds = np.flatnonzero(np.concatenate(([True], segment[1:] != segment[:-1])))
+        furthest = np.repeat(np.maximum.reduceat(distance, bounds), np.diff(np.append(bounds, len(segment))))
+
+        split = np.flatnonzero((distance > tolerance) & (distance == furthest))
+        if not len(split):
+            break
+
+        # Split each segment at its first furthest point, as the recursive version does
+        first = np.concatenate(([True], segment[split[1:]] != segment[split[:-1]]))
+        keep.ravel()[split[first]] = True
+
+    # simplify_gesture drops the end of every segment except the last one, and a segment of two
+    # adjacent points keeps only its start, unless it is the last one
+    following = np.minimum.accumulate(np.where(keep, positions, length)[:, ::-1], axis=1)[:, ::-1]
+    following = np.concatenate((following[:, 1:], np.full((num_landmarks, 1), length)), axis=1)
+    mask = keep & (following < length) & ((following - positions >= 2) | (following == length - 1))
+
+    last_start = np.max(np.where(keep[:, :-1], positions[:, :-1], 0), axis=1)
+    mask[:, -1] = length - 1 - last_start >= 2
+
+    # Trajectories of fewer than 3 points are not split at all
+    short = length - starts < 3
+    if np.any(short):
+        mask[short] = False
+        mask[rows[short, 0], starts[short]] = length - starts[short] == 2
+
+    return mask
+
+
+def resample_batch(points: np.ndarray, length: int, mask: np.ndarray = None):
+    """
+    Resample the (landmarks, time, 2) points of every landmark to `length` points evenly spaced along their path.
+    When a (landmarks, time) mask is given, each path is the polyline through the masked points only.
+    """
+    positions = np.broadcast_to(np.arange(points.shape[1]), points.shape[:2])
+    rows = np.arange(points.shape[0])[:, np.newaxis]
+    if mask is not None:
+        # Repeat the previous kept point in place of dropped ones, so they add no length to the path
+        kept = np.maximum.accumulate(np.where(mask, positions, -1), axis=1)
+        first = np.argmax(mask, axis=1)[:, np.newaxis]
+        points = points[rows, np.where(kept < 0, first, kept)]
+
+    steps = np.sqrt(np.sum(np.diff(points, axis=1) ** 2, axis=2))
+    distance = np.concatenate((np.zeros((points.shape[0], 1)), np.cumsum(steps, axis=1)), axis=1)
+    total = distance[:, -1:]
+    # A landmark that did not move is spread evenly over time instead
+    distance = np.where(total > 0, distance / np.where(total > 0, total, 1), positions / max(points.shape[1] - 1, 1))
+
+    targets = np.linspace(0, 1, length)
+    index = np.clip(np.sum(distance[:, :, np.newaxis] <= targets, axis=1) - 1, 0, points.shape[1] - 2)
+    start, end = distance[rows, index], distance[rows, index + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = np.clip(np.nan_to_num((targets - start) / (end - start)), 0, 1)
+
+    return points[rows, index] + fraction[..., np.newaxis] * (points[rows, index + 1] - points[rows, index])
 
 
 def select_landmarks(landmark_history: dict[int, list[tuple[int, int]]]):
@@ -102,6 +240,52 @@ def select_landmarks(landmark_history: dict[int, list[tuple[int, int]]]):
     return good_landmarks, numpy_landmarks
 
 
+def smooth_landmarks(tracking_points: np.ndarray):
+    """Smooth and centre the (landmarks, time, dims) tracking points"""
+    smoothed_points = gaussian_filter_batch(tracking_points, sigma=2)
+    smoothed_points -= np.mean(smoothed_points, axis=1, keepdims=True)
+
+    # savgol the smoothed points
+    return savgol_filter_batch(smoothed_points, 8, 3)
+
+
+def simplify_landmarks(tracking_points: np.ndarray):
+    """Smooth, centre and simplify the (landmarks, time, dims) tracking points, returning them with their keep masks"""
+    smoothed_points = smooth_landmarks(tracking_points)
+    return smoothed_points, simplify_gesture_batch(smoothed_points, 0.01)
+
+
+def simplify_windows(tracking_points: np.ndarray, window_sizes: list[int]):
+    """
+    Smooth the (landmarks, time, dims) tracking points once, then centre and simplify the newest frames
+    of each window size, returning a dict of window size to smoothed points and keep masks.
+    Every window matches simplify_landmarks on its own frames: the first frames of a window, whose filters reach
+    before it, are smoothed again with the same padding as the templates, only the rest is shared.
+    """
+    filtered = gaussian_filter_batch(tracking_points, sigma=2)
+    smoothed_points = savgol_filter_batch(filtered, 8, 3)
+
+    # Every window is simplified in one pass, each aligned on the newest frame and ignoring the frames before it
+    length = tracking_points.shape[1]
+    stacked = np.zeros((len(window_sizes),) + smoothed_points.shape)
+    for row, window in enumerate(window_sizes):
+        window_filtered = filtered[:, -window:]
+        window_smoothed = stacked[row, :, -window:]
+        window_smoothed[:] = smoothed_points[:, -window:]
+        if window < length:
+            # The Gaussian kernel reaches 3 frames to each side, the Savitzky-Golay window 4 more
+            window_filtered = window_filtered.copy()
+            window_filtered[:, :3] = gaussian_filter_batch(tracking_points[:, -window:][:, :6], sigma=2)[:, :3]
+            window_smoothed[:, :7] = savgol_filter_batch(window_filtered[:, :11], 8, 3)[:, :7]
+
+        # The Savitzky-Golay filter keeps constants, so centring after it equals centring before
+        window_smoothed -= np.mean(window_filtered, axis=1, keepdims=True)
+
+    starts = np.repeat([length - window for window in window_sizes], len(tracking_points))
+    masks = simplify_gesture_batch(stacked.reshape((-1,) + stacked.shape[2:]), 0.01, starts).reshape(stacked.shape[:3])
+    return {window: (stacked[row, :, -window:], masks[row, :, -window:]) for row, window in enumerate(window_sizes)}
+
+
 def process_landmarks(landmark_history: dict[..., list[tuple[int, int]]], include_landmarks: set[int] = None,
                       exclude_landmarks: set[int] = None, plot: bool = False):
     """Process the landmark history to select relevant landmarks and simplify the tracking points"""
@@ -113,29 +297,51 @@ def process_landmarks(landmark_history: dict[..., list[tuple[int, int]]], includ
     if exclude_landmarks:
         good_landmarks -= exclude_landmarks
 
-    # Simplify the tracking points for each landmark
+    # Simplify the tracking points of all landmarks together
+    landmark_ids = sorted(good_landmarks)
     simplified_landmarks = {}
-    for landmark_id in good_landmarks:
-        smoothed_points = gaussian_filter(numpy_landmarks[landmark_id], sigma=2)
-        smoothed_points -= np.mean(smoothed_points, axis=0)
-
-        # smoothed_points = np.array(smooth_gesture(tracking_points))
-        # savgol the smoothed points
-        smoothed_points = savgol_filter_points(smoothed_points, 8, 3)
-        smoothed_points = simplify_gesture(smoothed_points, 0.01)
-
-        if isinstance(smoothed_points, np.ndarray):
-            smoothed_points = smoothed_points.tolist()
+    if plot:
+        from matplotlib import pyplot as plt
 
-        simplified_landmarks[landmark_id] = smoothed_points
+    if landmark_ids:
+        smoothed, masks = simplify_landmarks(np.stack([numpy_landmarks[idx] for idx in landmark_ids]).astype(float))
+        for landmark_id, points, mask in zip(landmark_ids, smoothed, masks):
+            smoothed_points = points[mask].tolist()
+            simplified_landmarks[landmark_id] = smoothed_points
 
-        if plot:
-            # Plot with a deterministic color based on the landmark id
-            color = np.array([landmark_id * 100 % 255, landmark_id * 200 % 255, landmark_id * 300 % 255]) / 255
-            plt.plot(*zip(*smoothed_points), color=color, label=f'Landmark {landmark_id}')
+            if plot:
+                # Plot with a deterministic color based on the landmark id
+                color = np.array([landmark_id * 100 % 255, landmark_id * 200 % 255, landmark_id * 300 % 255]) / 255
+                plt.plot(*zip(*smoothed_points), color=color, label=f'Landmark {landmark_id}')
 
     if plot:
         plt.legend()
         plt.show()
 
     return simplified_landmarks
+
+
+def preprocess_landmarks(tracking_points: np.ndarray, landmark_ids: list[int]):
+    """
+    Simplify the (landmarks, time, dims) tracking points of the given landmarks once per frame,
+    so every gesture can share the result.
+    Unlike process_landmarks, the variance check is skipped since only the requested landmarks are returned.
+    """
+    if not landmark_ids:
+        return {}
+
+    smoothed, masks = simplify_landmarks(np.asarray(tracking_points, dtype=float))
+    return {landmark_id: points[mask].tolist() for landmark_id, points, mask in zip(landmark_ids, smoothed, masks)}
+
+
+def preprocess_windows(tracking_points: np.ndarray, landmark_ids: list[int], window_sizes: list[int]):
+    """
+    Simplify the newest frames of the given landmarks for each window size, sharing the smoothing between them.
+    Returns a dict of window size to the same {landmark_id: points} dict as preprocess_landmarks.
+    """
+    if not landmark_ids:
+        return {window: {} for window in window_sizes}
+
+    windows = simplify_windows(np.asarray(tracking_points, dtype=float), window_sizes)
+    return {window: {landmark_id: points[mask].tolist() for landmark_id, points, mask in zip(landmark_ids, *simplified)}
+            for window, simplified in windows.items()}
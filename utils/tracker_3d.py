@@ -1,148 +1,89 @@
 """
-This module contains the 3D tracker class and related functions.
-You can ignore it since we aren't actually using these anymore.
+3D counterparts of the tracker_2d functions, for the world landmarks of mediapipe pose including depth.
+Gestures toward the camera, like a punch, mostly move along z, which the 2D pipeline cannot see.
+Templates built with process_landmarks_3d are matched live with GestureTracker(mode='dtw3d').
 """
 
 import numpy as np
-from matplotlib import pyplot as plt
-from itertools import islice
-
-
-def normalize_gesture_3d(gesture):
-    x, y, z = zip(*gesture)
-    x_min, x_max, y_min, y_max, z_min, z_max = min(x), max(x), min(y), max(y), min(z), max(z)
-    x_axis_length = x_max - x_min
-    y_axis_length = y_max - y_min
-    axis_length = max(x_axis_length, y_axis_length) or 1
-    x_average = sum(x) / len(x)
-    y_average = sum(y) / len(y)
-    z_average = sum(z) / len(z)
-    normalized_x = [(x_i - x_average) / axis_length for x_i in x]
-    normalized_y = [(y_i - y_average) / axis_length for y_i in y]
-    normalized_z = [(z_i - z_average) / axis_length for z_i in z]
-    return normalized_x, normalized_y, normalized_z
-
-
-def laplacian_smoothing_3d(tracking_points: list[tuple[int, int, int]]):
-    """Smooth the tracking points using the mean of each point and its neighbors"""
-    smoothed_points = []
-    for i in range(len(tracking_points)):
-        x, y, z = tracking_points[i]
-        if i == 0:
-            x_prev, y_prev, z_prev = tracking_points[i]
-        else:
-            x_prev, y_prev, z_prev = tracking_points[i - 1]
-        if i == len(tracking_points) - 1:
-            x_next, y_next, z_next = tracking_points[i]
-        else:
-            x_next, y_next, z_next = tracking_points[i + 1]
-        smoothed_points.append(((x + x_prev + x_next) / 3, (y + y_prev + y_next) / 3, (z + z_prev + z_next) / 3))
-
-    return smoothed_points
-
-
-def perpendicular_distance_3d(point, start, end):
-    """Compute the perpendicular distance from the point to the line segment formed by start and end"""
-    x1, y1, z1 = start
-    x2, y2, z2 = end
-    x0, y0, z0 = point
-    if x1 == x2:
-        return abs(x0 - x1)
-    slope = (y2 - y1) / (x2 - x1)
-    intercept = y1 - slope * x1
-    return abs(slope * x0 - y0 + intercept) / np.sqrt(slope ** 2 + 1)
-
-
-def simplify_gesture_3d(points, tolerance):
-    """Simplify the given set of points using the Ramer-Douglas-Peucker algorithm"""
-    # Find the point with the maximum distance from the line segment formed by the start and end points
-    dmax = 0
-    index = 0
-    for i in range(1, len(points) - 1):
-        d = perpendicular_distance_3d(points[i], points[0], points[-1])
-        if d > dmax:
-            index = i
-            dmax = d
-    # If the maximum distance is greater than the tolerance, recursively simplify
-    if dmax > tolerance:
-        results1 = simplify_gesture_3d(list(islice(points, 0, index + 1)), tolerance)
-        results2 = simplify_gesture_3d(list(islice(points, index, len(points))), tolerance)
-        # Concatenate the simplified paths
-        results = results1[:-1] + results2
-    else:
-        results = [points[0], points[-1]]
-    return results
-
-
-def gaussian_filter_3d(points: list[tuple[int, int, int]], sigma: float = 1.0):
-    """Apply a Gaussian filter to the given points"""
-    # Compute the Gaussian kernel
-    kernel = np.exp(-np.arange(-3, 4) ** 2 / (2 * sigma ** 2))
-    kernel = kernel / np.sum(kernel)
-
-    # Apply the filter to the points
-    x_values, y_values, z_values = zip(*points)
-    x_values = np.convolve(x_values, kernel, mode='same')
-    y_values = np.convolve(y_values, kernel, mode='same')
-    z_values = np.convolve(z_values, kernel, mode='same')
-
-    return list(zip(x_values, y_values, z_values))
-
-
-def select_landmarks_3d(landmark_history: dict[int, list[tuple[int, int, int]]]):
-    """Select the relevant landmarks from the tracking points based on the variance of its signal"""
-    good_landmarks = set()
-    thresh = 0.125
-    for landmark_id, tracking_points in landmark_history.items():
-        # normalized = normalize_gesture(tracking_points)
-        # smoothed_points = laplacian_smoothing_3d(list(zip(*normalized)))
-
-        smoothed_points = laplacian_smoothing_3d(tracking_points)
-
-        # Check the variance of the signal to determine if the landmark is relevant
-        x_values, y_values, z_values = zip(*smoothed_points)
-        x_var = np.var(x_values)
-        y_var = np.var(y_values)
-        z_var = np.var(z_values)
-        # print(landmark_id, x_var, y_var, z_var)
-        if x_var > thresh or y_var > thresh or z_var > thresh:
-            good_landmarks.add(landmark_id)
-
-    # print(len(good_landmarks))
-    return good_landmarks
-
-
-def process_landmarks_3d(landmark_history: dict[..., list[tuple[int, int, int]]],
-                         relevant_landmarks: set[int] = None, plot: bool = False):
-    """Process the landmark history to select relevant landmarks and simplify the tracking points"""
-    # Select the relevant landmarks
-    good_landmarks = select_landmarks_3d(landmark_history).union(relevant_landmarks or set())
 
-    # Simplify the tracking points for each landmark
-    simplified_landmarks = {}
-    ax = None
-    if plot:
-        fig = plt.figure()
-        ax = fig.add_subplot(111, projection='3d')
+from utils.tracker_2d import gaussian_filter_batch, simplify_gesture_batch, simplify_landmarks
+
+
+def normalize_gesture_3d(gesture: np.ndarray):
+    """Translate the (time, 3) gesture to the origin and scale it by its largest x or y extent"""
+    gesture = np.asarray(gesture, dtype=float)
+    axis_length = max(np.ptp(gesture[:, 0]), np.ptp(gesture[:, 1])) or 1
+    return (gesture - gesture.mean(axis=0)) / axis_length
+
+
+def laplacian_smoothing_3d(tracking_points: np.ndarray):
+    """Smooth the (..., time, 3) tracking points using the mean of each point and its neighbors"""
+    tracking_points = np.asarray(tracking_points, dtype=float)
+    padded = np.concatenate((tracking_points[..., :1, :], tracking_points, tracking_points[..., -1:, :]), axis=-2)
+    return (padded[..., :-2, :] + padded[..., 1:-1, :] + padded[..., 2:, :]) / 3
+
+
+def perpendicular_distance_3d(point: np.ndarray, start: np.ndarray, end: np.ndarray):
+    """Compute the distance from the (..., 3) points to the line through start and end, in 3D"""
+    line = np.asarray(end, dtype=float) - start
+    offset = np.asarray(point, dtype=float) - start
+    length = np.linalg.norm(line)
+    if length == 0:
+        return np.linalg.norm(offset, axis=-1)
+
+    return np.linalg.norm(np.cross(line, offset), axis=-1) / length
 
-    for landmark_id in good_landmarks:
-        # simplified = simplify_gesture_3d(landmark_history[landmark_id], tolerance=0.01)
-        simplified = landmark_history[landmark_id]
 
-        smoothed_points = np.array(gaussian_filter_3d(simplified, sigma=1))
-        smoothed_points -= np.mean(smoothed_points, axis=0)
+def simplify_gesture_3d(points: np.ndarray, tolerance: float):
+    """Simplify the (time, 3) points with the Ramer-Douglas-Peucker algorithm, using the rules of simplify_gesture"""
+    points = np.asarray(points, dtype=float)
+    return points[simplify_gesture_batch(points[np.newaxis], tolerance)[0]]
 
-        # smoothed_points = np.array(smooth_gesture(tracking_points))
 
-        # Convert the smoothed points to a Python list
-        smoothed_points = smoothed_points.tolist()
-        simplified_landmarks[landmark_id] = smoothed_points
+def gaussian_filter_3d(points: np.ndarray, sigma: float = 1.0):
+    """Apply a Gaussian filter to the (time, 3) points"""
+    return gaussian_filter_batch(np.asarray(points, dtype=float)[np.newaxis], sigma)[0]
 
-        if plot:
-            # plot the simplified points in 3D
-            ax.plot(*zip(*smoothed_points), label=f'Landmark {landmark_id}')  # type: ignore
+
+def select_landmarks_3d(tracking_points: np.ndarray, threshold: float = 0.1):
+    """
+    Select the relevant landmarks based on the variance of their normalized signal along any axis,
+    like select_landmarks does in 2D.
+
+    :param tracking_points: numpy array of shape (landmarks, time, 3)
+    :param threshold: variance above which a landmark is relevant
+    :return: boolean array of shape (landmarks,)
+    """
+    normalized = np.stack([normalize_gesture_3d(points) for points in tracking_points])
+    smoothed_points = laplacian_smoothing_3d(normalized)
+    return np.any(np.var(smoothed_points, axis=1) > threshold, axis=1)
+
+
+def process_landmarks_3d(landmark_history: dict[..., list[tuple[float, float, float]]],
+                         relevant_landmarks: set[int] = None, plot: bool = False):
+    """Process the 3D landmark history with the same stages as process_landmarks, with distances measured in 3D"""
+    landmark_ids = sorted(landmark_history.keys())
+    if not landmark_ids:
+        return {}
+
+    tracking_points = np.stack([np.asarray(landmark_history[idx], dtype=float) for idx in landmark_ids])
+    selected = select_landmarks_3d(tracking_points)
+    relevant_landmarks = relevant_landmarks or set()
+    rows = [row for row, idx in enumerate(landmark_ids) if selected[row] or idx in relevant_landmarks]
+
+    simplified_landmarks = {}
+    if rows:
+        smoothed, masks = simplify_landmarks(tracking_points[rows])
+        for row, points, mask in zip(rows, smoothed, masks):
+            simplified_landmarks[landmark_ids[row]] = points[mask].tolist()
 
     if plot:
+        from matplotlib import pyplot as plt
+
+        ax = plt.figure().add_subplot(111, projection='3d')
+        for landmark_id, points in simplified_landmarks.items():
+            ax.plot(*zip(*points), label=f'Landmark {landmark_id}')  # type: ignore
+
         plt.legend()
         plt.show()
         plt.close()